@@ -0,0 +1,103 @@
+# Compare the FTS5 product search with the ILIKE scan it replaced, on a generated catalog. Every path
+# loads full product rows, as GET /products/get/{product_name} does.
+# usage: python -m benchmarks.search_benchmark [rows]
+import os
+import random
+import sys
+import tempfile
+import time
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "search_benchmark.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+from fastapi import HTTPException  # noqa: E402
+from sqlalchemy import or_  # noqa: E402
+from tele import database, models, search  # noqa: E402  (DATABASE_URL must be set first)
+from repository import product  # noqa: E402
+
+WORDS = ["wireless", "cotton", "steel", "smart", "classic", "ultra", "mini", "pro", "eco", "travel",
+         "kitchen", "running", "leather", "gaming", "organic", "portable", "vintage", "digital"]
+BRANDS = ["Acme", "Zenith", "Nova", "Orbit", "Apex", "Lumen"]
+CATEGORIES = ["Electronics", "Clothing", "Home", "Sports", "Toys"]
+QUERIES = ["wireless", "leather travel", "gam", "organic cotton"]
+REPEATS = 5
+
+
+# desc: Fill the product table with generated rows in batches
+def populate(rows: int):
+    table = models.Product.__table__
+    batch = []
+    with database.engine.begin() as connection:
+        for product_id in range(1, rows + 1):
+            batch.append({
+                "product_id": product_id,
+                "product_name": " ".join(random.sample(WORDS, 3)),
+                "description": " ".join(random.choices(WORDS, k=12)),
+                "category": random.choice(CATEGORIES),
+                "brand": random.choice(BRANDS),
+                "tags": ",".join(random.sample(WORDS, 2)),
+                "price": round(random.uniform(5, 500), 2),
+                "stock": random.randint(0, 100),
+                "sku": str(product_id).zfill(8),
+            })
+            if len(batch) == 10000:
+                connection.execute(table.insert(), batch)
+                batch = []
+        if batch:
+            connection.execute(table.insert(), batch)
+
+
+# desc: Time a search function over all benchmark queries
+# return: Average milliseconds per query
+def time_queries(run) -> float:
+    started = time.perf_counter()
+    for _ in range(REPEATS):
+        for query in QUERIES:
+            run(query)
+    return (time.perf_counter() - started) * 1000 / (REPEATS * len(QUERIES))
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    database.init_db()
+    populate(rows)
+
+    started = time.perf_counter()
+    if not search.init_search_index(database.engine):
+        sys.exit("FTS5 is not available in this SQLite build")
+    print(f"rows: {rows}, index build: {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    columns = [getattr(models.Product, column) for column in search.SEARCH_COLUMNS]
+    db = database.SessionLocal()
+    try:
+        # The query the search route ran before FTS5: every matching row, name only, unranked
+        old = time_queries(lambda query: db.query(models.Product)
+                           .filter(models.Product.product_name.ilike(f"%{query}%")).all())
+        # The same scan over the columns the FTS5 index covers, still unbounded
+        wide = time_queries(lambda query: db.query(models.Product)
+                            .filter(or_(*(column.ilike(f"%{query}%") for column in columns))).all())
+        # The current route: one ranked page of hits, loaded by ID
+        fts = time_queries(lambda query: _search_page(db, query))
+    finally:
+        db.close()
+
+    results = {
+        "old ILIKE scan (name only, all rows)": old,
+        "ILIKE scan (5 columns, all rows)": wide,
+        "FTS5 route (5 columns, BM25, one page)": fts,
+    }
+    for name, elapsed in results.items():
+        print(f"{name:<40} {elapsed:8.2f} ms/query")
+    print(f"fastest: {min(results, key=results.get)}")
+
+
+# desc: The search route's path, without its 404 when nothing matches
+def _search_page(db, query: str) -> list:
+    try:
+        return product.get_product_by_name(query, db)
+    except HTTPException:
+        return []
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+# Seller sales rollup: revenue, units and order counts per seller, product and day, counted from order lines.
+# usage: python -m repository.analytics rebuild [--seller-id N]
+import argparse
+import time
+from datetime import date, timedelta
+from sqlalchemy import and_, case, func, select
+from sqlalchemy.orm import Session
+from tele import database, models
+
+# Orders in these statuses (compared in lower case) no longer count as sales
+CANCELLED_STATUSES = ("cancelled", "canceled")
+
+# Date range of the analytics endpoint when the caller gives no start date
+DEFAULT_RANGE_DAYS = 30
+
+rollup = models.SellerDailySales.__table__
+MEASURES = ("order_count", "units", "revenue", "paid_revenue")
+
+
+# desc: What one order adds to its rollup row, given its status, payment status, quantity and price
+# return: Tuple of (order_count, units, revenue, paid_revenue)
+def _contribution(order_status: str, payment_status: str, quantity: int, total_price: float) -> tuple:
+    if (order_status or "").lower() in CANCELLED_STATUSES:
+        return 0, 0, 0.0, 0.0
+    paid_revenue = total_price if (payment_status or "").lower() == "paid" else 0.0
+    return 1, quantity, total_price, paid_revenue
+
+
+# desc: Add the changes to their rollup rows with relative UPDATEs, inserting the rows that do not exist yet.
+#       Runs in the caller's transaction, so the rollup commits or rolls back with the orders.
+def _apply(db: Session, changes: dict):
+    for (seller_id, day, product_id), change in changes.items():
+        if not any(change):
+            continue
+        key = (rollup.c.seller_id == seller_id, rollup.c.day == day, rollup.c.product_id == product_id)
+        result = db.execute(rollup.update().where(*key).values(
+            **{name: rollup.c[name] + value for name, value in zip(MEASURES, change)}
+        ))
+        if not result.rowcount:
+            db.execute(rollup.insert().values(
+                seller_id=seller_id, day=day, product_id=product_id, **dict(zip(MEASURES, change))
+            ))
+
+
+# desc: Accumulate a signed contribution under its rollup key
+def _add(changes: dict, key: tuple, contribution: tuple, sign: int = 1):
+    current = changes.get(key, (0, 0, 0.0, 0.0))
+    changes[key] = tuple(value + sign * extra for value, extra in zip(current, contribution))
+
+
+# desc: Sellers of the products of an order's lines
+# return: Dictionary of product_id to seller_id
+def _seller_ids(db: Session, order: models.Order) -> dict:
+    product_ids = {item.product_id for item in order.items}
+    return dict(db.query(models.Product.product_id, models.Product.seller_id)
+                  .filter(models.Product.product_id.in_(product_ids)).all())
+
+
+# desc: Count the lines of newly created (and flushed) orders; seller_ids maps product_id to the seller of the product
+def record_orders(db: Session, orders: list, seller_ids: dict):
+    changes = {}
+    for order in orders:
+        for item in order.items:
+            seller_id = seller_ids.get(item.product_id)
+            if seller_id is None:
+                continue
+            key = (seller_id, order.order_date.date(), item.product_id)
+            _add(changes, key, _contribution(order.order_status, order.payment_status, item.quantity, item.total_price))
+    _apply(db, changes)
+
+
+# desc: Move the contributions of an order's lines from its previous status and payment status to its current ones
+def record_status_change(db: Session, order: models.Order, old_status: str, old_payment_status: str):
+    if (old_status, old_payment_status) == (order.order_status, order.payment_status):
+        return
+    seller_ids = _seller_ids(db, order)
+    changes = {}
+    for item in order.items:
+        seller_id = seller_ids.get(item.product_id)
+        if seller_id is None:
+            continue
+        key = (seller_id, order.order_date.date(), item.product_id)
+        _add(changes, key, _contribution(order.order_status, order.payment_status, item.quantity, item.total_price))
+        _add(changes, key, _contribution(old_status, old_payment_status, item.quantity, item.total_price), -1)
+    _apply(db, changes)
+
+
+# desc: Move the contributions of many orders at once, for set-based updates. rows are order lines carrying
+#       the order_id, seller_id, order_date, product_id, quantity, total_price and the order's status and
+#       payment status before the update; values maps each order_id to the columns it was updated with
+#       (an order_status or payment_status that is not there is unchanged).
+def record_status_changes(db: Session, rows: list, values: dict):
+    changes = {}
+    for row in rows:
+        if row.seller_id is None or row.order_date is None or row.product_id is None:
+            continue
+        new_values = values.get(row.order_id, {})
+        new_status = new_values.get("order_status", row.order_status)
+        new_payment_status = new_values.get("payment_status", row.payment_status)
+        if (new_status, new_payment_status) == (row.order_status, row.payment_status):
+            continue
+        key = (row.seller_id, row.order_date.date(), row.product_id)
+        _add(changes, key, _contribution(new_status, new_payment_status, row.quantity, row.total_price))
+        _add(changes, key, _contribution(row.order_status, row.payment_status, row.quantity, row.total_price), -1)
+    _apply(db, changes)
+
+
+# desc: Take the lines of a deleted order out of the rollup
+def record_deleted(db: Session, order: models.Order):
+    seller_ids = _seller_ids(db, order)
+    changes = {}
+    for item in order.items:
+        seller_id = seller_ids.get(item.product_id)
+        if seller_id is None:
+            continue
+        _add(changes, (seller_id, order.order_date.date(), item.product_id),
+             _contribution(order.order_status, order.payment_status, item.quantity, item.total_price), -1)
+    _apply(db, changes)
+
+
+# desc: Order lines joined to their order's date and status, from the live or the archive tables
+def _order_lines(orders, items):
+    return select(items.c.product_id, orders.c.order_date, orders.c.order_status, orders.c.payment_status,
+                  items.c.quantity, items.c.total_price) \
+             .select_from(items.join(orders, orders.c.order_id == items.c.order_id))
+
+
+# desc: Recompute the rollup from the order lines, live and archived, with one INSERT ... SELECT ... GROUP BY,
+#       for backfills and repairs. Runs in the caller's transaction.
+# return: Number of rollup rows written
+def rebuild(db: Session, seller_id: int = None) -> int:
+    # Archived orders are still sales, so both sets of tables are read
+    orders = _order_lines(models.Order.__table__, models.OrderItem.__table__).union_all(
+        _order_lines(models.OrderArchive.__table__, models.OrderItemArchive.__table__)
+    ).subquery()
+    products = models.Product.__table__
+    active = func.lower(func.coalesce(orders.c.order_status, "")).notin_(CANCELLED_STATUSES)
+    paid = func.lower(func.coalesce(orders.c.payment_status, "")) == "paid"
+    day = func.date(orders.c.order_date)
+
+    source = select(
+        products.c.seller_id,
+        day,
+        orders.c.product_id,
+        func.sum(case((active, 1), else_=0)),
+        func.sum(case((active, orders.c.quantity), else_=0)),
+        func.sum(case((active, orders.c.total_price), else_=0.0)),
+        func.sum(case((and_(active, paid), orders.c.total_price), else_=0.0)),
+    ).select_from(orders.join(products, products.c.product_id == orders.c.product_id)) \
+     .where(products.c.seller_id.isnot(None), orders.c.order_date.isnot(None)) \
+     .group_by(products.c.seller_id, day, orders.c.product_id)
+
+    delete = rollup.delete()
+    if seller_id is not None:
+        source = source.where(products.c.seller_id == seller_id)
+        delete = delete.where(rollup.c.seller_id == seller_id)
+
+    db.execute(delete)
+    result = db.execute(rollup.insert().from_select(["seller_id", "day", "product_id", *MEASURES], source))
+    return result.rowcount
+
+
+# desc: Read a seller's sales per product and day from the rollup, by default over the last 30 days
+# return: The rollup rows (oldest day first) and their totals
+def get_seller_sales(db: Session, seller_id: int, date_from: date = None, date_to: date = None, product_id: int = None):
+    if date_from is None:
+        date_from = (date_to or date.today()) - timedelta(days=DEFAULT_RANGE_DAYS)
+    conditions = [models.SellerDailySales.seller_id == seller_id, models.SellerDailySales.day >= date_from]
+    if date_to is not None:
+        conditions.append(models.SellerDailySales.day <= date_to)
+    if product_id is not None:
+        conditions.append(models.SellerDailySales.product_id == product_id)
+
+    # Served by the (seller_id, day, product_id) primary key
+    rows = db.query(models.SellerDailySales).filter(*conditions) \
+             .order_by(models.SellerDailySales.day, models.SellerDailySales.product_id).all()
+    totals = {name: sum(getattr(row, name) for row in rows) for name in MEASURES}
+    return {"items": rows, "totals": totals}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seller sales rollup maintenance")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--seller-id", type=int, default=None, help="Only rebuild this seller's rows")
+    args = parser.parse_args()
+
+    database.init_db()
+    started = time.perf_counter()
+    db = database.SessionLocal()
+    try:
+        rows = rebuild(db, args.seller_id)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    print(f"wrote {rows} rollup rows in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,64 +1,73 @@
 from fastapi import HTTPException
 from sqlalchemy.orm import Session
 from tele import schemas, models
-import random
-import string
+from repository.product import get_cached_product, product_cache, decrement_stock
+from repository.cart_store import get_cart_store
+from repository import reservation, analytics, order_jobs
+from tele.tracking import generate_tracking_number
 from datetime import datetime, timedelta
 
-# Function to generate a unique tracking number
-def generate_tracking_number(length: int = 10) -> str:
-    characters = string.ascii_uppercase + string.digits
-    return ''.join(random.choice(characters) for _ in range(length))
+# Largest number of operations accepted by one batch request
+CART_BATCH_MAX_OPERATIONS = 500
+
+# desc: Commit the reservation changes made in db together with a cart store write. The SQL store's write
+#       commits the session, so both land in one transaction. The memory store keeps lines outside the
+#       database: the reservations are committed on their own first, and the line only changes once they are.
+# return: Whatever write returns
+def _write_cart(store, db: Session, write):
+    try:
+        if not store.commits_session:
+            db.commit()
+        return write()
+    except Exception:
+        db.rollback()
+        raise
 
 # Function to calculate the estimated delivery date (1 week from now)
 def get_estimated_delivery_date() -> str:
     return (datetime.now() + timedelta(weeks=1)).date()
 
-# Function to calculate the total price of items in the user's cart
+# Function to calculate the total price of items in the user's cart (read from the maintained cart summary)
 def calculate_cart_total(user_id: int, db: Session):
-    cart_items = db.query(models.Cart).filter(models.Cart.user_id == user_id).all()
-    if not cart_items:
+    summary = get_cart_store().get_summary(user_id, db)
+    if not summary["line_count"]:
         raise HTTPException(status_code=404, detail="Cart is empty")
-    
-    total = sum(item.quantity * db.query(models.Product).filter(models.Product.product_id == item.product_id).first().discounted_price for item in cart_items)
-    return {"total_price": total}
+
+    return {"total_price": summary["total_price"]}
+
+# desc: Reads the user's cart summary (line count, item count, total price, last change)
+# method: GET
+# return: The summary; an empty cart has zero counts rather than a 404, so the cart badge can always render
+def get_cart_summary(user_id: int, db: Session):
+    return get_cart_store().get_summary(user_id, db)
 
 # desc: Adds a new item to the user's cart or updates the quantity if it already exists
 # method: POST
 # return: The cart item details after adding/updating
 def add_to_cart(request: schemas.CartCreate, user_id: int, db: Session):
-    product = db.query(models.Product).filter(models.Product.product_id == request.product_id).first()
+    product = get_cached_product(request.product_id, db)
     
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
     if product.stock < request.quantity:
         raise HTTPException(status_code=400, detail="Insufficient stock for this quantity")
-    
-    cart_item = db.query(models.Cart).filter(
-        models.Cart.user_id == user_id,
-        models.Cart.product_id == request.product_id
-    ).first()
-
-    if cart_item:
-        cart_item.quantity += request.quantity
-    else:
-        cart_item = models.Cart(
-            user_id=user_id,
-            product_id=request.product_id,
-            quantity=request.quantity
-        )
-        db.add(cart_item)
 
-    db.commit()
-    db.refresh(cart_item)
-    return cart_item
+    # Hold the units for this cart, so checkout cannot fail for lack of stock while the hold lasts
+    if not reservation.reserve(db, user_id, request.product_id, request.quantity):
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Insufficient stock for this quantity")
+
+    store = get_cart_store()
+    return _write_cart(store, db, lambda: store.add(user_id, request.product_id, request.quantity, db,
+                                                    price=product.discounted_price))
 
 # desc: Retrieves all items in the user's cart along with their details and total price
 # method: GET
 # return: A dictionary containing the total price and item details
 def get_cart_items(user_id: int, db: Session):
-    cart_items = db.query(models.Cart).filter(models.Cart.user_id == user_id).all()
+    # Cart lines come back joined with the product columns they need, without a query per line
+    cart_items = get_cart_store().get_items(user_id, db)
     if not cart_items:
         raise HTTPException(status_code=404, detail="Cart is empty")
 
@@ -66,97 +75,221 @@ def get_cart_items(user_id: int, db: Session):
     items_with_details = []
 
     for item in cart_items:
-        product = db.query(models.Product).filter(models.Product.product_id == item.product_id).first()
-        if product:
-            item_total = product.discounted_price * item.quantity
-            total_price += item_total
-
-            items_with_details.append({
-                "product_id": item.product_id,
-                "quantity": item.quantity,
-                "item_total": item_total,
-                "product_name": product.product_name,
-                "product_price": product.discounted_price
-            })
+        item_total = item.discounted_price * item.quantity
+        total_price += item_total
+
+        items_with_details.append({
+            "product_id": item.product_id,
+            "quantity": item.quantity,
+            "item_total": item_total,
+            "product_name": item.product_name,
+            "product_price": item.discounted_price
+        })
 
     return {
         "total_price": total_price,
         "items": items_with_details
     }
 
+# desc: Applies a list of add/update/remove operations to the user's cart in a single transaction
+# method: POST
+# return: The resulting cart with its total price
+def apply_cart_batch(request: schemas.CartBatchRequest, user_id: int, db: Session):
+    operations = request.operations
+    if len(operations) > CART_BATCH_MAX_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"At most {CART_BATCH_MAX_OPERATIONS} operations per batch")
+
+    store = get_cart_store()
+    lines = store.get_lines(user_id, db)
+    lines_by_cart_id = {line.cart_id: line for line in lines}
+
+    # Replay the operations on the quantities first, so an invalid operation leaves the cart untouched
+    quantities = {line.product_id: line.quantity for line in lines}
+    touched = set()
+    for index, operation in enumerate(operations):
+        if operation.op == "add":
+            if operation.product_id is None or not operation.quantity or operation.quantity < 1:
+                raise HTTPException(status_code=400, detail=f"Operation {index}: add needs product_id and a positive quantity")
+            quantities[operation.product_id] = quantities.get(operation.product_id, 0) + operation.quantity
+            touched.add(operation.product_id)
+            continue
+
+        line = lines_by_cart_id.get(operation.cart_id)
+        if line is None or line.product_id not in quantities:
+            raise HTTPException(status_code=404, detail=f"Operation {index}: cart item not found")
+        if operation.op == "remove":
+            del quantities[line.product_id]
+        else:
+            if not operation.quantity or operation.quantity < 1:
+                raise HTTPException(status_code=400, detail=f"Operation {index}: update needs a positive quantity")
+            quantities[line.product_id] = operation.quantity
+            touched.add(line.product_id)
+
+    # One query validates stock for every touched product and supplies the details of the response
+    products = {
+        product.product_id: product
+        for product in db.query(
+            models.Product.product_id, models.Product.product_name, models.Product.discounted_price, models.Product.stock
+        ).filter(models.Product.product_id.in_(list(quantities))).all()
+    } if quantities else {}
+    for product_id in touched:
+        if product_id not in quantities:
+            continue
+        if product_id not in products:
+            raise HTTPException(status_code=404, detail=f"Product with ID {product_id} not found")
+        if products[product_id].stock < quantities[product_id]:
+            raise HTTPException(status_code=400, detail=f"Insufficient stock for product ID {product_id}")
+
+    # Grow or shrink the holds to the new quantities; one failed hold undoes the whole batch
+    current = {line.product_id: line.quantity for line in lines}
+    try:
+        for product_id in set(current) | set(quantities):
+            change = quantities.get(product_id, 0) - current.get(product_id, 0)
+            if change > 0 and not reservation.reserve(db, user_id, product_id, change):
+                raise HTTPException(status_code=400, detail=f"Insufficient stock for product ID {product_id}")
+            if change < 0:
+                reservation.release(db, user_id, product_id, -change)
+    except Exception:
+        db.rollback()
+        raise
+
+    prices = {product_id: product.discounted_price for product_id, product in products.items()}
+    _write_cart(store, db, lambda: store.replace(user_id, quantities, db, prices=prices))
+
+    items = [
+        {
+            "product_id": product_id,
+            "quantity": quantity,
+            "item_total": products[product_id].discounted_price * quantity,
+            "product_name": products[product_id].product_name,
+            "product_price": products[product_id].discounted_price
+        }
+        for product_id, quantity in quantities.items() if product_id in products
+    ]
+    return {"total_price": sum(item["item_total"] for item in items), "items": items}
+
 # desc: Updates the quantity of a specific item in the user's cart
 # method: PUT
 # return: The updated cart item details
 def update_cart_item(cart_id: int, quantity: int, user_id: int, db: Session):
-    cart_item = db.query(models.Cart).filter(models.Cart.cart_id == cart_id, models.Cart.user_id == user_id).first()
+    store = get_cart_store()
+    cart_item = store.get_line(user_id, cart_id, db)
     if not cart_item:
         raise HTTPException(status_code=404, detail="Cart item not found")
     
-    product = db.query(models.Product).filter(models.Product.product_id == cart_item.product_id).first()
+    product = get_cached_product(cart_item.product_id, db)
     if product.stock < quantity:
         raise HTTPException(status_code=400, detail="Insufficient stock for this quantity")
-    
-    cart_item.quantity = quantity
-    db.commit()
-    db.refresh(cart_item)
+
+    change = quantity - cart_item.quantity
+    if change > 0 and not reservation.reserve(db, user_id, cart_item.product_id, change):
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Insufficient stock for this quantity")
+    if change < 0:
+        reservation.release(db, user_id, cart_item.product_id, -change)
+
+    cart_item = _write_cart(store, db, lambda: store.set_quantity(user_id, cart_id, quantity, db,
+                                                                  price=product.discounted_price))
+    if not cart_item:
+        db.rollback()
+        raise HTTPException(status_code=404, detail="Cart item not found")
     return cart_item
 
 # desc: Deletes an item from the user's cart
 # method: DELETE
 # return: A success message indicating the item has been deleted
 def delete_cart_item(cart_id: int, user_id: int, db: Session):
-    cart_item = db.query(models.Cart).filter(models.Cart.cart_id == cart_id, models.Cart.user_id == user_id).first()
+    store = get_cart_store()
+    cart_item = store.get_line(user_id, cart_id, db)
     if not cart_item:
         raise HTTPException(status_code=404, detail="Cart item not found")
 
-    db.delete(cart_item)
-    db.commit()
+    reservation.release(db, user_id, cart_item.product_id)
+
+    # The unit price lets the cart summary be adjusted instead of recomputed
+    product = get_cached_product(cart_item.product_id, db)
+    price = product.discounted_price if product else None
+    if not _write_cart(store, db, lambda: store.remove(user_id, cart_id, db, price=price)):
+        db.rollback()
+        raise HTTPException(status_code=404, detail="Cart item not found")
+
     return {"detail": "Item deleted from cart"}
 
 # desc: Processes an order for all items in the user's cart
 # method: POST
 # return: A summary of the order, including the total cost and order details
 def order_cart(user_id: int, db: Session):
-    cart_items = db.query(models.Cart).filter(models.Cart.user_id == user_id).all()
+    with get_cart_store().checkout(user_id, db) as cart_items:
+        orders_response, total_order_cost = _place_cart_orders(user_id, cart_items, db)
+
+    # Stock changed, drop the cached snapshots of the ordered products
+    for item in cart_items:
+        product_cache.invalidate(item.product_id)
+
+    return {"total_order_cost": total_order_cost, "orders": orders_response}
+
+# desc: Takes the stock, creates one order with an item per cart line and removes the ordered lines in
+#       one transaction
+# return: The serialized orders (a list holding the one order, as before multi-line orders) and their total cost
+def _place_cart_orders(user_id: int, cart_items: list, db: Session):
     if not cart_items:
         raise HTTPException(status_code=404, detail="Cart is empty")
 
-    total_order_cost = 0
-    order_records = []
-    
-    for item in cart_items:
-        product = db.query(models.Product).filter(models.Product.product_id == item.product_id).first()
-        if not product:
-            raise HTTPException(status_code=404, detail=f"Product with ID {item.product_id} not found")
-        
-        if product.stock < item.quantity:
-            raise HTTPException(status_code=400, detail=f"Insufficient stock for product ID {product.product_id}")
-        
-        item_total = product.discounted_price * item.quantity
-        total_order_cost += item_total
-
-        product.stock -= item.quantity
+    address = db.query(models.User.address).filter(models.User.user_id == user_id).scalar()
+    products = {
+        product.product_id: product
+        for product in db.query(models.Product.product_id, models.Product.discounted_price, models.Product.seller_id)
+                         .filter(models.Product.product_id.in_([item.product_id for item in cart_items])).all()
+    }
+    missing = [item.product_id for item in cart_items if item.product_id not in products]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Product with ID {missing[0]} not found")
+
+    try:
+        # Conditional decrements: a concurrent checkout that took the stock first makes this one fail.
+        # Each line's reservation is consumed by the same UPDATE, so held units are always available.
+        for item in cart_items:
+            held = reservation.take(db, user_id, item.product_id)
+            if not decrement_stock(db, item.product_id, item.quantity, held):
+                raise HTTPException(status_code=400, detail=f"Insufficient stock for product ID {item.product_id}")
 
+        order_items = [
+            models.OrderItem(
+                product_id=item.product_id,
+                quantity=item.quantity,
+                unit_price=products[item.product_id].discounted_price,
+                total_price=products[item.product_id].discounted_price * item.quantity
+            )
+            for item in cart_items
+        ]
+        # The header keeps the first line's product and the totals for clients that read orders as single lines
         new_order = models.Order(
             user_id=user_id,
-            product_id=item.product_id,
-            quantity=item.quantity,
-            total_price=item_total,
-            delivery_address=db.query(models.User).filter(models.User.user_id == user_id).first().address,
+            product_id=order_items[0].product_id,
+            quantity=sum(item.quantity for item in order_items),
+            total_price=sum(item.total_price for item in order_items),
+            delivery_address=address,
             payment_method="Cart Payment",
             tracking_number=generate_tracking_number(),
-            estimated_delivery_date=get_estimated_delivery_date()
+            estimated_delivery_date=get_estimated_delivery_date(),
+            items=order_items
         )
         db.add(new_order)
-        order_records.append(new_order)
 
-    db.commit()
-    
-    # Serialize orders before returning
-    orders_response = [schemas.OrderResponse.from_orm(order) for order in order_records]
+        # Clear the ordered lines in the same transaction as the orders
+        get_cart_store().remove_ordered(user_id, cart_items, db)
+        db.flush()
 
-    # Clear the cart after successful ordering
-    db.query(models.Cart).filter(models.Cart.user_id == user_id).delete()
-    db.commit()
+        # Count the sales in the seller rollup within the same transaction
+        analytics.record_orders(db, [new_order], {product_id: product.seller_id for product_id, product in products.items()})
+        # Notifications, invoicing and fraud checks run in the background once the checkout commits
+        order_jobs.publish_order_placed(db, [new_order])
 
-    return {"total_order_cost": total_order_cost, "orders": orders_response}
+        # Serialize before the commit expires the new rows, which would reload them
+        orders_response = [schemas.OrderResponse.from_orm(new_order)]
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    return orders_response, sum(order.total_price for order in orders_response)
@@ -0,0 +1,557 @@
+from collections import namedtuple
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from datetime import datetime
+from sqlalchemy import and_, bindparam, event, func, select
+from sqlalchemy.orm import Session
+from tele import models, database
+import logging
+import os
+import threading
+import time
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# "sql" keeps every cart change in the cart table; "memory" holds active carts in this process and
+# writes them back in the background. The memory store assumes a single application process.
+CART_STORE = os.getenv("CART_STORE", "sql")
+CART_FLUSH_INTERVAL_SECONDS = float(os.getenv("CART_FLUSH_INTERVAL_SECONDS", "5"))
+CART_FLUSH_BATCH_SIZE = int(os.getenv("CART_FLUSH_BATCH_SIZE", "200"))  # Carts written per flush transaction
+CART_IDLE_SECONDS = float(os.getenv("CART_IDLE_SECONDS", "1800"))  # Clean carts untouched this long are dropped from memory
+
+# Session.info key of the products whose cart summaries a memory store forgets when the session commits
+_STALE_PRODUCTS = "stale_cart_products"
+
+
+# One cart line, detached from any session
+@dataclass
+class CartLine:
+    cart_id: int
+    user_id: int
+    product_id: int
+    quantity: int
+    added_date: datetime
+
+
+# Cart line joined with the product columns the cart views need
+CartItemRow = namedtuple("CartItemRow", ["product_id", "quantity", "product_name", "discounted_price"])
+
+
+def _to_line(row: models.Cart) -> CartLine:
+    return CartLine(row.cart_id, row.user_id, row.product_id, row.quantity, row.added_date)
+
+
+def _summary(line_count: int, item_count: int, total_price: float, updated_at: datetime) -> dict:
+    return {"line_count": line_count, "item_count": item_count, "total_price": total_price, "updated_at": updated_at}
+
+
+# desc: Line count, item count and total of a list of lines, given the unit price of each product
+# return: Summary dictionary; lines whose product has no price are left out, like the joined queries do
+def _summarize(lines, prices: dict) -> dict:
+    priced = [(line.quantity, prices[line.product_id]) for line in lines if line.product_id in prices]
+    return _summary(
+        len(priced),
+        sum(quantity for quantity, _ in priced),
+        sum(quantity * (price or 0.0) for quantity, price in priced),
+        datetime.now(),
+    )
+
+
+# desc: Cart storage backed directly by the cart table; every change is its own transaction
+class SqlCartStore:
+    # Writes commit the caller's session, and with it whatever the caller changed there first
+    commits_session = True
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def flush(self):
+        pass
+
+    # desc: Nothing is held in memory; expired rows are deleted from the table by the sweeper
+    def expire_lines(self, cutoff: datetime) -> int:
+        return 0
+
+    # return: All lines of the user's cart, oldest first
+    def get_lines(self, user_id: int, db: Session) -> list:
+        rows = db.query(models.Cart).filter(models.Cart.user_id == user_id).order_by(models.Cart.cart_id).all()
+        return [_to_line(row) for row in rows]
+
+    # return: The user's cart line with this ID, or None
+    def get_line(self, user_id: int, cart_id: int, db: Session):
+        row = db.query(models.Cart).filter(models.Cart.cart_id == cart_id, models.Cart.user_id == user_id).first()
+        return _to_line(row) if row else None
+
+    # return: Cart lines joined with product name and price, from one query
+    def get_items(self, user_id: int, db: Session) -> list:
+        return db.query(
+            models.Cart.product_id,
+            models.Cart.quantity,
+            models.Product.product_name,
+            models.Product.discounted_price
+        ).join(models.Product, models.Product.product_id == models.Cart.product_id) \
+         .filter(models.Cart.user_id == user_id).order_by(models.Cart.cart_id).all()
+
+    # desc: Read the user's cart summary, recomputing it first if it is missing or marked stale
+    # return: Summary dictionary (line_count, item_count, total_price, updated_at)
+    def get_summary(self, user_id: int, db: Session) -> dict:
+        row = db.query(models.CartSummary).filter(models.CartSummary.user_id == user_id).first()
+        if row is None or row.stale:
+            row = self._recompute_summary(user_id, db)
+            db.commit()
+        return _summary(row.line_count, row.item_count, row.total_price, row.updated_at)
+
+    # desc: Rebuild the summary row from the cart table inside the caller's transaction
+    # return: The summary row
+    def _recompute_summary(self, user_id: int, db: Session) -> models.CartSummary:
+        db.flush()
+        line_count, item_count, total_price = db.query(
+            func.count(models.Cart.cart_id),
+            func.coalesce(func.sum(models.Cart.quantity), 0),
+            func.coalesce(func.sum(models.Cart.quantity * models.Product.discounted_price), 0.0)
+        ).join(models.Product, models.Product.product_id == models.Cart.product_id) \
+         .filter(models.Cart.user_id == user_id).one()
+        return self._store_summary(user_id, _summary(line_count, item_count, total_price, datetime.now()), db)
+
+    def _store_summary(self, user_id: int, summary: dict, db: Session) -> models.CartSummary:
+        return db.merge(models.CartSummary(user_id=user_id, stale=False, **summary))
+
+    # desc: Apply the change of one cart line to the summary inside the caller's transaction. The row is
+    #       updated with relative SET expressions so concurrent changes do not overwrite each other; a
+    #       missing or stale row, or an unknown price, falls back to a recompute.
+    def _adjust_summary(self, user_id: int, db: Session, lines: int, items: int, price: float = None):
+        if price is not None:
+            updated = db.query(models.CartSummary).filter(
+                models.CartSummary.user_id == user_id, models.CartSummary.stale.is_(False)
+            ).update({
+                models.CartSummary.line_count: models.CartSummary.line_count + lines,
+                models.CartSummary.item_count: models.CartSummary.item_count + items,
+                models.CartSummary.total_price: models.CartSummary.total_price + items * price,
+                models.CartSummary.updated_at: datetime.now(),
+            }, synchronize_session=False)
+            if updated:
+                return
+        self._recompute_summary(user_id, db)
+
+    # desc: Mark the summaries of every cart holding this product as stale inside the caller's transaction
+    #       (no commit). Call it before the product row is deleted, while the cart rows still point at it.
+    def mark_stale(self, product_id: int, db: Session):
+        db.query(models.CartSummary).filter(
+            models.CartSummary.user_id.in_(select(models.Cart.user_id).where(models.Cart.product_id == product_id))
+        ).update({models.CartSummary.stale: True}, synchronize_session=False)
+
+    # desc: price is the product's unit price, used to update the cart summary without recomputing it
+    # return: The line after adding quantity to it, creating it if the product is not in the cart yet
+    def add(self, user_id: int, product_id: int, quantity: int, db: Session, price: float = None) -> CartLine:
+        row = db.query(models.Cart).filter(models.Cart.user_id == user_id, models.Cart.product_id == product_id).first()
+        if row:
+            row.quantity += quantity
+            self._adjust_summary(user_id, db, 0, quantity, price)
+        else:
+            row = models.Cart(user_id=user_id, product_id=product_id, quantity=quantity)
+            db.add(row)
+            self._adjust_summary(user_id, db, 1, quantity, price)
+        db.commit()
+        db.refresh(row)
+        return _to_line(row)
+
+    # return: The updated line, or None if the user has no such line
+    def set_quantity(self, user_id: int, cart_id: int, quantity: int, db: Session, price: float = None):
+        row = db.query(models.Cart).filter(models.Cart.cart_id == cart_id, models.Cart.user_id == user_id).first()
+        if not row:
+            return None
+        change = quantity - row.quantity
+        row.quantity = quantity
+        self._adjust_summary(user_id, db, 0, change, price)
+        db.commit()
+        db.refresh(row)
+        return _to_line(row)
+
+    # return: True if the line existed and was removed
+    def remove(self, user_id: int, cart_id: int, db: Session, price: float = None) -> bool:
+        row = db.query(models.Cart).filter(models.Cart.cart_id == cart_id, models.Cart.user_id == user_id).first()
+        if not row:
+            return False
+        db.delete(row)
+        self._adjust_summary(user_id, db, -1, -row.quantity, price)
+        db.commit()
+        return True
+
+    # desc: Make the cart hold exactly the given product quantities, in one transaction; prices maps
+    #       product_id to unit price and sets the summary directly
+    def replace(self, user_id: int, quantities: dict, db: Session, prices: dict = None):
+        rows = {row.product_id: row for row in db.query(models.Cart).filter(models.Cart.user_id == user_id).all()}
+        for product_id, row in rows.items():
+            if product_id not in quantities:
+                db.delete(row)
+            elif row.quantity != quantities[product_id]:
+                row.quantity = quantities[product_id]
+        for product_id, quantity in quantities.items():
+            if product_id not in rows:
+                db.add(models.Cart(user_id=user_id, product_id=product_id, quantity=quantity))
+        if prices is None:
+            self._recompute_summary(user_id, db)
+        else:
+            lines = [CartLine(None, user_id, product_id, quantity, None) for product_id, quantity in quantities.items()]
+            self._store_summary(user_id, _summarize(lines, prices), db)
+        db.commit()
+
+    # desc: Hand the cart lines to a checkout; the caller deletes them with remove_ordered and commits
+    @contextmanager
+    def checkout(self, user_id: int, db: Session):
+        yield self.get_lines(user_id, db)
+
+    # desc: Take the checked-out quantities off their lines inside the caller's transaction (no commit):
+    #       a line grown while the checkout ran keeps the difference. The summary is rebuilt from what is
+    #       left, which after a checkout is normally nothing.
+    def remove_ordered(self, user_id: int, lines: list, db: Session):
+        table = models.Cart.__table__
+        ordered = [{"ordered_cart_id": line.cart_id, "ordered_quantity": line.quantity} for line in lines]
+        if ordered:
+            same_line = and_(table.c.user_id == user_id, table.c.cart_id == bindparam("ordered_cart_id"))
+            db.execute(table.delete().where(same_line, table.c.quantity <= bindparam("ordered_quantity")), ordered)
+            db.execute(table.update().where(same_line, table.c.quantity > bindparam("ordered_quantity"))
+                            .values(quantity=table.c.quantity - bindparam("ordered_quantity")), ordered)
+        self._recompute_summary(user_id, db)
+
+
+# desc: Cart storage that keeps active carts in memory and writes them to the cart table in the
+#       background. The store itself only touches the database to load a cart the first time; the
+#       stock reservations made by cart writes that grow or shrink a line are still committed per request.
+class MemoryCartStore:
+    # Writes change memory only; the caller commits its own changes to the session
+    commits_session = False
+
+    def __init__(self, flush_interval: float, flush_batch_size: int, idle_seconds: float):
+        self.flush_interval = flush_interval
+        self.flush_batch_size = flush_batch_size
+        self.idle_seconds = idle_seconds
+        # user_id -> {"lines": {product_id: CartLine}, "dirty": bool, "touched": float,
+        #             "summary": dict or None when unknown, "revision": int bumped by every change}
+        self._carts = {}
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()  # Serializes flushes
+        self._user_locks = {}  # user_id -> Lock held while that user's cart is checked out or written
+        self._next_cart_id = None
+        self._stopping = threading.Event()
+        self._thread = None
+
+    # desc: Start the background flusher thread
+    def start(self):
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="cart-flusher", daemon=True)
+            self._thread.start()
+
+    # desc: Stop the flusher and write every pending change
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        while self.flush():
+            pass
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_interval):
+            try:
+                while self.flush() == self.flush_batch_size:
+                    pass
+                self._evict_idle()
+            except Exception as e:
+                logger.error(f"Cart flush failed: {e}")
+
+    # desc: Load the user's cart from the database the first time it is used; the caller holds no lock
+    # return: The in-memory cart entry
+    def _cart(self, user_id: int, db: Session) -> dict:
+        with self._lock:
+            cart = self._carts.get(user_id)
+            if cart is not None:
+                cart["touched"] = time.monotonic()
+                return cart
+
+        rows = db.query(models.Cart).filter(models.Cart.user_id == user_id).order_by(models.Cart.cart_id).all()
+        with self._lock:
+            if self._next_cart_id is None:
+                self._next_cart_id = (db.query(func.max(models.Cart.cart_id)).scalar() or 0) + 1
+            cart = self._carts.setdefault(user_id, {
+                "lines": {row.product_id: _to_line(row) for row in rows},
+                "dirty": False,
+                "touched": time.monotonic(),
+                "summary": None,
+                "revision": 0,
+            })
+            return cart
+
+    # desc: The lock serializing checkouts and flushes of one user's cart; other users are not blocked
+    def _user_lock(self, user_id: int) -> threading.Lock:
+        with self._lock:
+            return self._user_locks.setdefault(user_id, threading.Lock())
+
+    def _changed(self, cart: dict):
+        cart["dirty"] = True
+        cart["touched"] = time.monotonic()
+        cart["revision"] += 1
+
+    # desc: Apply the change of one cart line to the in-memory summary; the caller holds the lock
+    def _adjust_summary(self, cart: dict, lines: int, items: int, price: float = None):
+        summary = cart["summary"]
+        if summary is None or price is None:
+            cart["summary"] = None
+            return
+        summary["line_count"] += lines
+        summary["item_count"] += items
+        summary["total_price"] += items * price
+        summary["updated_at"] = datetime.now()
+
+    def get_lines(self, user_id: int, db: Session) -> list:
+        cart = self._cart(user_id, db)
+        with self._lock:
+            return sorted((replace(line) for line in cart["lines"].values()), key=lambda line: line.cart_id)
+
+    def get_line(self, user_id: int, cart_id: int, db: Session):
+        return next((line for line in self.get_lines(user_id, db) if line.cart_id == cart_id), None)
+
+    # return: Cart lines joined with product name and price; products are loaded with one IN query
+    def get_items(self, user_id: int, db: Session) -> list:
+        lines = self.get_lines(user_id, db)
+        if not lines:
+            return []
+        products = {
+            product.product_id: product
+            for product in db.query(models.Product.product_id, models.Product.product_name, models.Product.discounted_price)
+                             .filter(models.Product.product_id.in_([line.product_id for line in lines])).all()
+        }
+        return [
+            CartItemRow(line.product_id, line.quantity, products[line.product_id].product_name,
+                        products[line.product_id].discounted_price)
+            for line in lines if line.product_id in products
+        ]
+
+    # desc: Serve the summary from memory; an unknown one is rebuilt with one price query
+    def get_summary(self, user_id: int, db: Session) -> dict:
+        cart = self._cart(user_id, db)
+        with self._lock:
+            if cart["summary"] is not None:
+                return dict(cart["summary"])
+            revision = cart["revision"]
+            lines = [replace(line) for line in cart["lines"].values()]
+
+        prices = dict(
+            db.query(models.Product.product_id, models.Product.discounted_price)
+              .filter(models.Product.product_id.in_([line.product_id for line in lines])).all()
+        ) if lines else {}
+        summary = _summarize(lines, prices)
+        with self._lock:
+            # Keep the result only if the cart did not change while the prices were read
+            if cart["revision"] == revision:
+                cart["summary"] = summary
+        return dict(summary)
+
+    # desc: Forget the summaries of the in-memory carts holding this product once the caller's transaction
+    #       commits, so a summary rebuilt before then cannot keep the old price. Carts that are not in memory
+    #       get a fresh summary when they are loaded.
+    def mark_stale(self, product_id: int, db: Session):
+        db.info.setdefault(_STALE_PRODUCTS, {}).setdefault(self, set()).add(product_id)
+
+    def _forget_summaries(self, product_ids: set):
+        with self._lock:
+            for cart in self._carts.values():
+                if not product_ids.isdisjoint(cart["lines"]):
+                    cart["summary"] = None
+                    cart["revision"] += 1
+
+    def add(self, user_id: int, product_id: int, quantity: int, db: Session, price: float = None) -> CartLine:
+        cart = self._cart(user_id, db)
+        with self._lock:
+            line = cart["lines"].get(product_id)
+            if line:
+                line.quantity += quantity
+                self._adjust_summary(cart, 0, quantity, price)
+            else:
+                line = CartLine(self._next_cart_id, user_id, product_id, quantity, datetime.now())
+                self._next_cart_id += 1
+                cart["lines"][product_id] = line
+                self._adjust_summary(cart, 1, quantity, price)
+            self._changed(cart)
+            return replace(line)
+
+    def set_quantity(self, user_id: int, cart_id: int, quantity: int, db: Session, price: float = None):
+        cart = self._cart(user_id, db)
+        with self._lock:
+            line = next((line for line in cart["lines"].values() if line.cart_id == cart_id), None)
+            if not line:
+                return None
+            self._adjust_summary(cart, 0, quantity - line.quantity, price)
+            line.quantity = quantity
+            self._changed(cart)
+            return replace(line)
+
+    def remove(self, user_id: int, cart_id: int, db: Session, price: float = None) -> bool:
+        cart = self._cart(user_id, db)
+        with self._lock:
+            line = next((line for line in cart["lines"].values() if line.cart_id == cart_id), None)
+            if not line:
+                return False
+            del cart["lines"][line.product_id]
+            self._adjust_summary(cart, -1, -line.quantity, price)
+            self._changed(cart)
+            return True
+
+    def replace(self, user_id: int, quantities: dict, db: Session, prices: dict = None):
+        cart = self._cart(user_id, db)
+        with self._lock:
+            lines = {}
+            for product_id, quantity in quantities.items():
+                line = cart["lines"].get(product_id)
+                if line is None:
+                    line = CartLine(self._next_cart_id, user_id, product_id, quantity, datetime.now())
+                    self._next_cart_id += 1
+                line.quantity = quantity
+                lines[product_id] = line
+            cart["lines"] = lines
+            cart["summary"] = _summarize(lines.values(), prices) if prices is not None else None
+            self._changed(cart)
+
+    # desc: Hand a snapshot of the cart lines to a checkout, holding off flushes and other checkouts of
+    #       this user only. Once the caller's transaction has committed, the snapshotted quantities are
+    #       taken off the lines: lines added or grown while the checkout ran are kept.
+    @contextmanager
+    def checkout(self, user_id: int, db: Session):
+        with self._user_lock(user_id):
+            lines = self.get_lines(user_id, db)
+            yield lines
+            ordered = {line.cart_id: line.quantity for line in lines}
+            with self._lock:
+                cart = self._carts.get(user_id)
+                if cart is None:
+                    return
+                kept = {}
+                for product_id, line in cart["lines"].items():
+                    line.quantity -= ordered.get(line.cart_id, 0)
+                    if line.quantity > 0:
+                        kept[product_id] = line
+                cart["lines"] = kept
+                if kept:
+                    # The table lost the ordered rows with the checkout; write back what is left
+                    cart["summary"] = None
+                    self._changed(cart)
+                else:
+                    cart["summary"] = _summary(0, 0, 0.0, datetime.now())
+                    cart["revision"] += 1
+
+    # desc: Delete the already-flushed copies of checked-out lines inside the caller's transaction; flushes
+    #       of this cart wait for the checkout, so the rows still hold the snapshotted quantities
+    def remove_ordered(self, user_id: int, lines: list, db: Session):
+        db.query(models.Cart).filter(models.Cart.user_id == user_id,
+                                     models.Cart.cart_id.in_([line.cart_id for line in lines])) \
+          .delete(synchronize_session=False)
+
+    # desc: Write up to flush_batch_size changed carts to the cart table in one transaction. Carts being
+    #       checked out are left dirty for a later flush.
+    # return: Number of carts written
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._lock:
+                candidates = [user_id for user_id, cart in self._carts.items() if cart["dirty"]]
+            held = []
+            for user_id in candidates:
+                if len(held) == self.flush_batch_size:
+                    break
+                lock = self._user_lock(user_id)
+                if lock.acquire(blocking=False):
+                    held.append((user_id, lock))
+            try:
+                return self._write([user_id for user_id, _ in held])
+            finally:
+                for _, lock in held:
+                    lock.release()
+
+    # desc: Write the in-memory lines of the given carts over their rows; the caller holds their user locks
+    # return: Number of carts written
+    def _write(self, user_ids: list) -> int:
+        with self._lock:
+            user_ids = [user_id for user_id in user_ids if user_id in self._carts]
+            snapshot = []
+            for user_id in user_ids:
+                cart = self._carts[user_id]
+                cart["dirty"] = False
+                snapshot.extend(replace(line) for line in cart["lines"].values())
+        if not user_ids:
+            return 0
+
+        db = database.SessionLocal()
+        try:
+            db.query(models.Cart).filter(models.Cart.user_id.in_(user_ids)).delete(synchronize_session=False)
+            # Summaries live in memory with this store; drop the table rows so they are never served stale
+            db.query(models.CartSummary).filter(models.CartSummary.user_id.in_(user_ids)) \
+              .delete(synchronize_session=False)
+            if snapshot:
+                db.execute(models.Cart.__table__.insert(), [vars(line) for line in snapshot])
+            db.commit()
+        except Exception:
+            db.rollback()
+            with self._lock:
+                for user_id in user_ids:
+                    if user_id in self._carts:
+                        self._carts[user_id]["dirty"] = True
+            raise
+        finally:
+            db.close()
+        return len(user_ids)
+
+    # desc: Drop in-memory lines added before cutoff; the next flush removes them from the table too
+    # return: Number of lines dropped
+    def expire_lines(self, cutoff: datetime) -> int:
+        expired = 0
+        with self._lock:
+            for cart in self._carts.values():
+                kept = {product_id: line for product_id, line in cart["lines"].items()
+                        if line.added_date is None or line.added_date >= cutoff}
+                if len(kept) != len(cart["lines"]):
+                    expired += len(cart["lines"]) - len(kept)
+                    cart["lines"] = kept
+                    cart["summary"] = None
+                    self._changed(cart)
+        return expired
+
+    # desc: Drop carts that are fully written and have not been used for idle_seconds
+    def _evict_idle(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            for user_id in [user_id for user_id, cart in self._carts.items()
+                            if not cart["dirty"] and cart["touched"] < cutoff]:
+                del self._carts[user_id]
+
+
+# Registered once for every session: memory stores forget the summaries marked stale in a transaction
+# when it commits, and nothing if it rolls back
+@event.listens_for(Session, "after_commit")
+def _forget_stale_summaries(session: Session):
+    for store, product_ids in session.info.pop(_STALE_PRODUCTS, {}).items():
+        store._forget_summaries(product_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _keep_summaries(session: Session):
+    session.info.pop(_STALE_PRODUCTS, None)
+
+
+_store = None
+
+
+# desc: The cart store selected by CART_STORE, created on first use
+def get_cart_store():
+    global _store
+    if _store is None:
+        if CART_STORE == "memory":
+            _store = MemoryCartStore(CART_FLUSH_INTERVAL_SECONDS, CART_FLUSH_BATCH_SIZE, CART_IDLE_SECONDS)
+        elif CART_STORE == "sql":
+            _store = SqlCartStore()
+        else:
+            raise ValueError(f"Unknown CART_STORE {CART_STORE!r}, expected 'sql' or 'memory'")
+    return _store
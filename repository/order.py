@@ -1,15 +1,23 @@
+from sqlalchemy import and_, bindparam, or_
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from sqlalchemy.orm import Session
-from tele import models, schemas
+from tele import models, schemas, pagination
+from tele.tracking import generate_tracking_number
+from repository.product import product_cache, decrement_stock
+from repository import analytics, order_jobs
 from fastapi import HTTPException, status
-import random
-import string
+import logging
+import os
 from datetime import datetime, timedelta
 
+# Set up logging
+logger = logging.getLogger(__name__)
 
-# desc: Generate a random string of characters for the tracking number
-def generate_tracking_number(length: int = 10) -> str:
-    characters = string.ascii_uppercase + string.digits
-    return ''.join(random.choice(characters) for _ in range(length))
+TRACKING_NUMBER_IN_USE = "Tracking number is already in use"
+
+# Bulk updates: orders written per transaction, and the most orders one request may list or match
+ORDER_BULK_CHUNK_SIZE = int(os.getenv("ORDER_BULK_CHUNK_SIZE", "500"))
+ORDER_BULK_MAX_ORDERS = int(os.getenv("ORDER_BULK_MAX_ORDERS", "10000"))
 
 
 # desc: Generate the estimated delivery date (one week from the current date)
@@ -17,12 +25,14 @@ def get_estimated_delivery_date() -> str:
     return (datetime.now() + timedelta(weeks=1)).date()
 
 
-# desc: Create a new order in the database
+# desc: Create a new order in the database; notifications, invoicing and fraud checks are queued as
+#       background jobs in the same transaction instead of running in the request
 # params: request (OrderCreate schema), user_id (int), db (Session)
-# return: Newly created order object
+# return: Newly created order
 def create_order(request: schemas.OrderCreate, user_id: int, db: Session):
-    # Fetch the product to get the price and stock
-    product = db.query(models.Product).filter(models.Product.product_id == request.product_id).first()
+    # Fetch the product columns needed for the price, stock check and seller rollup
+    product = db.query(models.Product.product_id, models.Product.discounted_price, models.Product.stock,
+                       models.Product.seller_id).filter(models.Product.product_id == request.product_id).first()
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
 
@@ -31,14 +41,14 @@ def create_order(request: schemas.OrderCreate, user_id: int, db: Session):
         raise HTTPException(status_code=400, detail="Out of stock")
 
     # Fetch the user to get the delivery address
-    user = db.query(models.User).filter(models.User.user_id == user_id).first()
+    user = db.query(models.User.address).filter(models.User.user_id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
     # Calculate the total price based on quantity
     total_price = product.discounted_price * request.quantity
 
-    # Generate a random tracking number
+    # Generate a unique, time-ordered tracking number
     tracking_number = generate_tracking_number()
 
     # Get the estimated delivery date
@@ -52,46 +62,133 @@ def create_order(request: schemas.OrderCreate, user_id: int, db: Session):
         delivery_address=user.address,
         payment_method=request.payment_method,
         tracking_number=tracking_number,
-        estimated_delivery_date=estimated_delivery_date
+        estimated_delivery_date=estimated_delivery_date,
+        items=[models.OrderItem(product_id=request.product_id, quantity=request.quantity,
+                                unit_price=product.discounted_price, total_price=total_price)]
     )
 
-    # Decrease the product stock
-    product.stock -= request.quantity
+    # Decrease the product stock, unless a concurrent order took it first
+    if not decrement_stock(db, product.product_id, request.quantity):
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Out of stock")
 
-    # Add and commit the new order to the database
+    # Add the new order, count it in the seller rollup and queue its follow-up work, then commit all of it
     db.add(new_order)
+    db.flush()
+    analytics.record_orders(db, [new_order], {product.product_id: product.seller_id})
+    order_jobs.publish_order_placed(db, [new_order])
+
+    # Serialize before the commit expires the new row, which would reload it
+    order_response = schemas.OrderResponse.from_orm(new_order)
     db.commit()
-    db.refresh(new_order)
-    db.refresh(product)
 
-    return new_order
+    # Stock changed, refresh the cached snapshot on the next read
+    product_cache.invalidate(request.product_id)
 
+    return order_response
 
-# desc: Retrieve an order by its ID
-# params: order_id (int), db (Session)
+
+# desc: Build the filter conditions of the order history routes, on Order or on OrderArchive
+# return: List of conditions on the model's columns (empty when no filter is given)
+def order_filters(order_status: str = None, payment_status: str = None,
+                  date_from: datetime = None, date_to: datetime = None, model=models.Order) -> list:
+    conditions = []
+    if order_status is not None:
+        conditions.append(model.order_status == order_status)
+    if payment_status is not None:
+        conditions.append(model.payment_status == payment_status)
+    if date_from is not None:
+        conditions.append(model.order_date >= date_from)
+    if date_to is not None:
+        conditions.append(model.order_date < date_to)
+    return conditions
+
+
+# desc: Run one keyset page of a query on Order or OrderArchive, after the (order_date, order_id) position
+def _order_page(query, model, limit: int, last_date: datetime = None, last_id: int = None) -> list:
+    if last_id is not None:
+        query = query.filter(or_(
+            model.order_date < last_date,
+            and_(model.order_date == last_date, model.order_id < last_id)
+        ))
+    return query.order_by(model.order_date.desc(), model.order_id.desc()).limit(limit + 1).all()
+
+
+# desc: Fetch one keyset page of an order query, newest first, with order_id as the tie-breaker.
+#       With archive_query (the same query on OrderArchive) both tables are read with the same
+#       position and merged; order IDs never appear in both.
+# return: (orders, next_cursor) where next_cursor is None on the last page
+def paginate_orders(query, limit: int, cursor: str = None, archive_query=None):
+    last_date = last_id = None
+    if cursor:
+        last_date, last_id = pagination.decode_cursor(cursor, 2)
+        try:
+            last_date = datetime.fromisoformat(last_date)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+    orders = _order_page(query, models.Order, limit, last_date, last_id)
+    if archive_query is not None:
+        archived = _order_page(archive_query, models.OrderArchive, limit, last_date, last_id)
+        orders = sorted(orders + archived, key=lambda order: (order.order_date, order.order_id), reverse=True)[:limit + 1]
+
+    next_cursor = None
+    if len(orders) > limit:
+        orders = orders[:limit]
+        next_cursor = pagination.encode_cursor(orders[-1].order_date, orders[-1].order_id)
+    return orders, next_cursor
+
+
+# desc: Retrieve an order by its ID, looking in the archive too when include_archived is set
+# params: order_id (int), db (Session), include_archived (bool)
 # return: Order object if found, else raises HTTPException
-def get_order_by_id(order_id: int, db: Session):
+def get_order_by_id(order_id: int, db: Session, include_archived: bool = False):
     order = db.query(models.Order).filter(models.Order.order_id == order_id).first()
+    if not order and include_archived:
+        order = db.query(models.OrderArchive).filter(models.OrderArchive.order_id == order_id).first()
+    if not order:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Order not found")
+    return order
+
+
+# desc: Retrieve an order by its tracking number, served by the unique tracking_number index
+# params: tracking_number (str), db (Session), include_archived (bool)
+# return: Order object
+def get_order_by_tracking_number(tracking_number: str, db: Session, include_archived: bool = False):
+    order = db.query(models.Order).filter(models.Order.tracking_number == tracking_number).first()
+    if not order and include_archived:
+        order = db.query(models.OrderArchive).filter(models.OrderArchive.tracking_number == tracking_number).first()
     if not order:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Order not found")
     return order
 
 
+# desc: Set a tracking number given by the caller, rejecting one that belongs to another order
+def _set_tracking_number(db: Session, order: models.Order, tracking_number: str):
+    taken = db.query(models.Order.order_id) \
+              .filter(models.Order.tracking_number == tracking_number, models.Order.order_id != order.order_id).first()
+    if taken:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=TRACKING_NUMBER_IN_USE)
+    order.tracking_number = tracking_number
+
+
 # desc: Update an existing order
 # params: order_id (int), request (OrderUpdate schema), db (Session)
 # return: Updated order object
 def update_order(order_id: int, request: schemas.OrderUpdate, db: Session):
     order = get_order_by_id(order_id, db)
+    old_status, old_payment_status = order.order_status, order.payment_status
 
     if request.order_status is not None:
         order.order_status = request.order_status
     if request.payment_status is not None:
         order.payment_status = request.payment_status
     if request.tracking_number is not None:
-        order.tracking_number = request.tracking_number
+        _set_tracking_number(db, order, request.tracking_number)
     if request.estimated_delivery_date is not None:
         order.estimated_delivery_date = request.estimated_delivery_date
 
+    analytics.record_status_change(db, order, old_status, old_payment_status)
     db.commit()
     db.refresh(order)
     return order
@@ -102,10 +199,13 @@ def update_order(order_id: int, request: schemas.OrderUpdate, db: Session):
 # return: Confirmation message and deleted order details
 def delete_order(order_id: int, db: Session):
     order = get_order_by_id(order_id, db)
+    # Serialize first: the ORM object links to its items and back, and is expired by the commit
+    deleted = schemas.OrderResponse.from_orm(order)
 
     db.delete(order)
+    analytics.record_deleted(db, order)
     db.commit()
-    return {"detail": "Order deleted successfully", "order": order}
+    return {"detail": "Order deleted successfully", "order": deleted}
 
 
 # desc: Mark an order as paid
@@ -113,6 +213,7 @@ def delete_order(order_id: int, db: Session):
 # return: Updated order object
 def pay_order(order_id: int, request: schemas.OrderUpdate, db: Session):
     order = get_order_by_id(order_id, db)
+    old_status, old_payment_status = order.order_status, order.payment_status
 
     # Update payment status to "paid"
     order.payment_status = "paid"
@@ -121,10 +222,168 @@ def pay_order(order_id: int, request: schemas.OrderUpdate, db: Session):
     if request.order_status is not None:
         order.order_status = request.order_status
     if request.tracking_number is not None:
-        order.tracking_number = request.tracking_number
+        _set_tracking_number(db, order, request.tracking_number)
     if request.estimated_delivery_date is not None:
         order.estimated_delivery_date = request.estimated_delivery_date
 
+    analytics.record_status_change(db, order, old_status, old_payment_status)
     db.commit()
     db.refresh(order)
     return order
+
+
+# desc: Update a chunk of orders, each with its own column values, moving their contributions in the
+#       seller rollup within the same transaction. Orders changing the same columns share one statement:
+#       a single UPDATE ... WHERE order_id IN (...) when the values are equal too, else one executemany
+#       UPDATE ... WHERE order_id = ?.
+# return: IDs of the orders that exist and were updated
+def _update_chunk(db: Session, values: dict) -> set:
+    # One row per order line, with the order's status before the update
+    rows = db.query(models.Order.order_id, models.OrderItem.product_id, models.Order.order_date,
+                    models.OrderItem.quantity, models.OrderItem.total_price, models.Order.order_status,
+                    models.Order.payment_status, models.Product.seller_id) \
+             .outerjoin(models.OrderItem, models.OrderItem.order_id == models.Order.order_id) \
+             .outerjoin(models.Product, models.Product.product_id == models.OrderItem.product_id) \
+             .filter(models.Order.order_id.in_(list(values))).all()
+    updated = {row.order_id for row in rows}
+    if not updated:
+        return updated
+
+    groups = {}
+    for order_id in updated:
+        groups.setdefault(tuple(sorted(values[order_id])), []).append(order_id)
+    table = models.Order.__table__
+    for columns, order_ids in groups.items():
+        distinct = {tuple(values[order_id][name] for name in columns) for order_id in order_ids}
+        if len(distinct) == 1:
+            db.execute(table.update().where(table.c.order_id.in_(order_ids)).values(**values[order_ids[0]]))
+        else:
+            db.execute(
+                table.update().where(table.c.order_id == bindparam("match_order_id"))
+                     .values(**{name: bindparam(f"new_{name}") for name in columns}),
+                [{"match_order_id": order_id, **{f"new_{name}": values[order_id][name] for name in columns}}
+                 for order_id in order_ids]
+            )
+    analytics.record_status_changes(db, rows, values)
+    return updated
+
+
+# desc: The bulk counterpart of _set_tracking_number's check, with one query for the whole chunk
+# return: IDs of the orders in values whose new tracking number belongs to another order
+def _taken_tracking_numbers(db: Session, values: dict) -> set:
+    wanted = {order_id: changes["tracking_number"] for order_id, changes in values.items() if "tracking_number" in changes}
+    if not wanted:
+        return set()
+    owners = dict(db.query(models.Order.tracking_number, models.Order.order_id)
+                    .filter(models.Order.tracking_number.in_(set(wanted.values()))).all())
+    return {order_id for order_id, tracking_number in wanted.items() if owners.get(tracking_number, order_id) != order_id}
+
+
+# desc: Stable reason for an order that failed to update; the database error itself is only logged,
+#       since its text names tables, columns and constraints
+def _failure_detail(order_id: int, error: SQLAlchemyError) -> str:
+    logger.warning(f"Bulk update of order {order_id} failed: {error}")
+    if isinstance(error, IntegrityError) and "tracking_number" in str(error.orig):
+        return TRACKING_NUMBER_IN_USE
+    return "Order could not be updated"
+
+
+# desc: Update a chunk of orders in one transaction and record the outcome of each order; values maps
+#       each order_id to its column values. A failed chunk is rolled back and retried one order per
+#       transaction, so only the offending orders fail; the other chunks still apply.
+def _apply_chunk(db: Session, values: dict, outcomes: dict):
+    conflicts = _taken_tracking_numbers(db, values)
+    for order_id in conflicts:
+        outcomes[order_id] = {"order_id": order_id, "status": "failed", "detail": TRACKING_NUMBER_IN_USE}
+    values = {order_id: changes for order_id, changes in values.items() if order_id not in conflicts}
+    if not values:
+        return
+
+    try:
+        updated = _update_chunk(db, values)
+        db.commit()
+    except SQLAlchemyError as e:
+        db.rollback()
+        if len(values) > 1:
+            for order_id, changes in values.items():
+                _apply_chunk(db, {order_id: changes}, outcomes)
+            return
+        order_id = next(iter(values))
+        outcomes[order_id] = {"order_id": order_id, "status": "failed", "detail": _failure_detail(order_id, e)}
+        return
+    for order_id in values:
+        outcomes[order_id] = {"order_id": order_id, "status": "updated" if order_id in updated else "not_found"}
+
+
+# desc: The columns an OrderUpdate changes (fields left as None are kept, like update_order does)
+def _update_values(update: schemas.OrderUpdate) -> dict:
+    return {name: value for name, value in update.dict(exclude={"order_id"}).items() if value is not None}
+
+
+# desc: Update many orders at once, from a list of per-order updates or from a filter plus a patch.
+#       Orders are written in chunks of ORDER_BULK_CHUNK_SIZE, each chunk in its own transaction with
+#       one statement per set of changed columns, so per-order values (e.g. tracking numbers) cost no
+#       more round trips than a shared patch.
+# params: request (OrderBulkUpdate schema), db (Session)
+# return: Counts and the outcome of every order
+def bulk_update_orders(request: schemas.OrderBulkUpdate, db: Session):
+    if (request.updates is None) == (request.filter is None):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Send either updates, or filter and patch")
+
+    outcomes = {}
+    if request.updates is not None:
+        order_ids = [update.order_id for update in request.updates]
+        if len(order_ids) > ORDER_BULK_MAX_ORDERS:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"At most {ORDER_BULK_MAX_ORDERS} orders per request")
+        if len(set(order_ids)) != len(order_ids):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Each order_id may appear only once")
+
+        pending = {}
+        for update in request.updates:
+            changes = _update_values(update)
+            if changes:
+                pending[update.order_id] = changes
+            else:
+                outcomes[update.order_id] = {"order_id": update.order_id, "status": "failed",
+                                             "detail": "No fields to update"}
+        # Chunks of ORDER_BULK_CHUNK_SIZE orders in request order, one transaction each
+        order_ids = list(pending)
+        for start in range(0, len(order_ids), ORDER_BULK_CHUNK_SIZE):
+            _apply_chunk(db, {order_id: pending[order_id]
+                              for order_id in order_ids[start:start + ORDER_BULK_CHUNK_SIZE]}, outcomes)
+        results = [outcomes[update.order_id] for update in request.updates]
+    else:
+        values = _update_values(request.patch) if request.patch is not None else {}
+        if not values:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="patch has no fields to update")
+        conditions = order_filters(**request.filter.dict())
+        if not conditions:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="filter needs at least one condition")
+
+        # The same cap as a list of updates, so one filter cannot rewrite (and report on) the whole table
+        matched = db.query(models.Order.order_id).filter(*conditions).limit(ORDER_BULK_MAX_ORDERS + 1).count()
+        if matched > ORDER_BULK_MAX_ORDERS:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"filter matches more than {ORDER_BULK_MAX_ORDERS} orders, narrow it down")
+
+        # Walk the matching orders by order_id, so orders the patch makes stop matching are not skipped.
+        # Orders placed during the walk can match too; the walk stops at the cap all the same.
+        last_id = 0
+        while len(outcomes) < ORDER_BULK_MAX_ORDERS:
+            chunk = [order_id for (order_id,) in db.query(models.Order.order_id)
+                     .filter(models.Order.order_id > last_id, *conditions)
+                     .order_by(models.Order.order_id)
+                     .limit(min(ORDER_BULK_CHUNK_SIZE, ORDER_BULK_MAX_ORDERS - len(outcomes))).all()]
+            if not chunk:
+                break
+            _apply_chunk(db, {order_id: values for order_id in chunk}, outcomes)
+            last_id = chunk[-1]
+        results = list(outcomes.values())
+
+    return {
+        "updated": sum(1 for outcome in results if outcome["status"] == "updated"),
+        "not_found": sum(1 for outcome in results if outcome["status"] == "not_found"),
+        "failed": sum(1 for outcome in results if outcome["status"] == "failed"),
+        "outcomes": results,
+    }
@@ -0,0 +1,48 @@
+# Moves old delivered or cancelled orders from orders to orders_archive, run in batches by the sweeper.
+from datetime import datetime
+from sqlalchemy import func, literal, select
+from sqlalchemy.orm import Session
+from tele import models
+import os
+
+ORDER_ARCHIVE_AFTER_DAYS = float(os.getenv("ORDER_ARCHIVE_AFTER_DAYS", "180"))  # 0 disables archival
+# Final statuses (compared in lower case); orders in any other status can still change and stay hot
+ARCHIVE_STATUSES = tuple(
+    name.strip().lower() for name in os.getenv("ORDER_ARCHIVE_STATUSES", "delivered,cancelled,canceled").split(",")
+)
+
+orders = models.Order.__table__
+archive = models.OrderArchive.__table__
+items = models.OrderItem.__table__
+items_archive = models.OrderItemArchive.__table__
+
+
+# desc: Move up to batch_size finished orders placed before cutoff, and their lines, into the archive in
+#       the caller's transaction: one INSERT ... SELECT and one DELETE per table and batch
+# return: Number of orders archived
+def archive_orders(db: Session, cutoff: datetime, batch_size: int) -> int:
+    # Order IDs are never reused (AUTOINCREMENT), but one reused before that may already be in the
+    # archive; such an order stays in orders rather than failing the sweep
+    archived = select(archive.c.order_id).where(archive.c.order_id == orders.c.order_id).exists()
+    order_ids = [order_id for (order_id,) in db.execute(
+        select(orders.c.order_id)
+        .where(orders.c.order_date < cutoff, func.lower(orders.c.order_status).in_(ARCHIVE_STATUSES), ~archived)
+        .order_by(orders.c.order_date).limit(batch_size)
+    ).all()]
+    if not order_ids:
+        return 0
+
+    columns = [column.name for column in orders.columns]
+    db.execute(archive.insert().from_select(
+        columns + ["archived_at"],
+        select(*orders.columns, literal(datetime.now())).where(orders.c.order_id.in_(order_ids))
+    ))
+    # Archived lines get new item IDs, so a reused order_items ID can never clash in the archive
+    item_columns = [column.name for column in items.columns if column.name != "item_id"]
+    db.execute(items_archive.insert().from_select(
+        item_columns,
+        select(*(items.c[name] for name in item_columns)).where(items.c.order_id.in_(order_ids))
+    ))
+    db.execute(items.delete().where(items.c.order_id.in_(order_ids)))
+    db.execute(orders.delete().where(orders.c.order_id.in_(order_ids)))
+    return len(order_ids)
@@ -0,0 +1,100 @@
+# Migration of orders written before order_items existed: each one gets a single line built from the
+# product, quantity and price on its header. Runs at startup until it has finished once, which is recorded
+# in schema_migration; orders that already have lines are skipped.
+# usage: python -m repository.order_items backfill [--batch-size N] [--force]
+import argparse
+import logging
+import os
+import time
+from datetime import datetime
+from sqlalchemy import func, select
+from tele import database, models
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+ORDER_ITEMS_BACKFILL_BATCH_SIZE = int(os.getenv("ORDER_ITEMS_BACKFILL_BATCH_SIZE", "1000"))  # Orders per transaction
+MIGRATION_NAME = "order_items_backfill"
+
+
+# desc: Give the orders in one order_id range without lines a line copied from the header, with one
+#       INSERT ... SELECT in the caller's transaction
+# return: Number of lines written
+def _backfill_range(db, orders, items, first_id: int, last_id: int) -> int:
+    has_items = select(items.c.order_id).where(items.c.order_id == orders.c.order_id).exists()
+    source = select(
+        orders.c.order_id,
+        orders.c.product_id,
+        orders.c.quantity,
+        func.coalesce(orders.c.total_price / func.nullif(orders.c.quantity, 0), orders.c.total_price),
+        orders.c.total_price,
+    ).where(orders.c.order_id.between(first_id, last_id), orders.c.product_id.isnot(None), ~has_items)
+    result = db.execute(items.insert().from_select(
+        ["order_id", "product_id", "quantity", "unit_price", "total_price"], source
+    ))
+    return result.rowcount
+
+
+# desc: Walk orders and orders_archive by order_id in batches, each in its own transaction, and write the
+#       missing lines. Every order placed since order_items exists has its lines, so once a run has
+#       finished later calls return at once, unless force is set.
+# return: Number of lines written
+def backfill_order_items(batch_size: int = ORDER_ITEMS_BACKFILL_BATCH_SIZE, force: bool = False) -> int:
+    if not force:
+        db = database.SessionLocal()
+        try:
+            if db.get(models.SchemaMigration, MIGRATION_NAME) is not None:
+                return 0
+        finally:
+            db.close()
+
+    written = 0
+    tables = ((models.Order.__table__, models.OrderItem.__table__),
+              (models.OrderArchive.__table__, models.OrderItemArchive.__table__))
+    for orders, items in tables:
+        last_id = 0
+        while True:
+            db = database.SessionLocal()
+            try:
+                order_ids = [order_id for (order_id,) in db.execute(
+                    select(orders.c.order_id).where(orders.c.order_id > last_id)
+                    .order_by(orders.c.order_id).limit(batch_size)
+                ).all()]
+                if order_ids:
+                    written += _backfill_range(db, orders, items, order_ids[0], order_ids[-1])
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+            if len(order_ids) < batch_size:
+                break
+            last_id = order_ids[-1]
+
+    db = database.SessionLocal()
+    try:
+        db.merge(models.SchemaMigration(name=MIGRATION_NAME, finished_at=datetime.now()))
+        db.commit()
+    finally:
+        db.close()
+    if written:
+        logger.info(f"Backfilled {written} order lines")
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Order lines maintenance")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--batch-size", type=int, default=ORDER_ITEMS_BACKFILL_BATCH_SIZE)
+    parser.add_argument("--force", action="store_true", help="Run again even if a backfill has finished")
+    args = parser.parse_args()
+
+    database.init_db()
+    started = time.perf_counter()
+    written = backfill_order_items(args.batch_size, args.force)
+    print(f"wrote {written} order lines in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+# Follow-up work for placed orders, run by the background job queue instead of the request.
+import logging
+from sqlalchemy.orm import Session
+from tele import models
+from tele.jobs import job_queue
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+ORDER_PLACED = "order.placed"
+
+
+# desc: Queue the order.placed handlers for orders created in the caller's transaction
+def publish_order_placed(db: Session, orders: list):
+    job_queue.publish(db, ORDER_PLACED, {"order_ids": [order.order_id for order in orders]})
+
+
+def _load_orders(payload: dict, db: Session) -> list:
+    return db.query(models.Order).filter(models.Order.order_id.in_(payload["order_ids"])).all()
+
+
+# desc: Send the order confirmation to the customer (stub until a notification provider is set up)
+@job_queue.subscribe(ORDER_PLACED, "order.send_confirmation")
+def send_confirmation(payload: dict, db: Session):
+    for order in _load_orders(payload, db):
+        logger.info(f"Order confirmation for order {order.order_id} to user {order.user_id}")
+
+
+# desc: Generate the invoice of the orders (stub until invoicing is implemented)
+@job_queue.subscribe(ORDER_PLACED, "order.generate_invoice")
+def generate_invoice(payload: dict, db: Session):
+    for order in _load_orders(payload, db):
+        logger.info(f"Invoice for order {order.order_id}: {order.total_price}")
+
+
+# desc: Screen the orders for fraud (stub until a fraud check provider is set up). Nothing is checked
+#       yet, so every order is logged as unscreened rather than as passed.
+@job_queue.subscribe(ORDER_PLACED, "order.check_fraud")
+def check_fraud(payload: dict, db: Session):
+    for order in _load_orders(payload, db):
+        logger.warning(f"Fraud check for order {order.order_id} skipped: no fraud check provider is configured")
@@ -1,8 +1,39 @@
 from fastapi import HTTPException, status,Depends
+from pydantic import ValidationError
+from sqlalchemy import and_, case, func, literal, or_, select
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
-from tele import schemas, models
-import random,string
-from datetime import datetime
+from tele import schemas, models, pagination, search, database
+from tele.cache import LRUCache
+from repository.cart_store import get_cart_store
+import csv,io,json,os,random,string,sys
+from datetime import datetime, timedelta
+
+# Read cache of product snapshots, keyed by product_id
+PRODUCT_CACHE_TTL_SECONDS = float(os.getenv("PRODUCT_CACHE_TTL_SECONDS", "300"))
+PRODUCT_CACHE_MAX_ENTRIES = int(os.getenv("PRODUCT_CACHE_MAX_ENTRIES", "10000"))
+PRODUCT_CACHE_MAX_BYTES = int(os.getenv("PRODUCT_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+# Largest number of IDs accepted by one batch lookup
+PRODUCT_BATCH_MAX_SIZE = int(os.getenv("PRODUCT_BATCH_MAX_SIZE", "100"))
+
+# Bulk import: rows validated and inserted per transaction, and how many row errors are reported back
+IMPORT_CHUNK_SIZE = int(os.getenv("PRODUCT_IMPORT_CHUNK_SIZE", "1000"))
+IMPORT_MAX_REPORTED_ERRORS = 1000
+
+# Catalog export: rows fetched from the database cursor per batch
+EXPORT_BATCH_SIZE = int(os.getenv("PRODUCT_EXPORT_BATCH_SIZE", "1000"))
+# updated_at is set when a change is flushed, which can be a while before it commits; the export
+# watermark is held back by this much so changes committed after an export are in the next one
+EXPORT_WATERMARK_LAG_SECONDS = float(os.getenv("PRODUCT_EXPORT_WATERMARK_LAG_SECONDS", "60"))
+
+# Columns the product listing can be ordered by; each one is backed by a (column, product_id) index
+SORT_COLUMNS = {
+    "product_id": models.Product.product_id,
+    "price": models.Product.price,
+    "rating": models.Product.rating,
+    "launch_date": models.Product.launch_date,
+}
 
 def generate_package_number(length: int = 10) -> str:
     digits = string.digits  # Only digits 0-9
@@ -17,6 +48,33 @@ def discount(price: float, discount_percent: float) -> float:
         return price  
     return price - (price * (discount_percent / 100))
 
+# desc: SQL form of discount(), for recomputing discounted_price inside an UPDATE
+def discount_expression(price, discount_percent):
+    return case((and_(discount_percent > 0, discount_percent < 100), price - price * (discount_percent / 100)), else_=price)
+
+# desc: Approximate memory held by a cached product snapshot
+def _snapshot_size(snapshot: schemas.ProductDetail) -> int:
+    return sys.getsizeof(snapshot) + sum(sys.getsizeof(value) for value in snapshot.__dict__.values())
+
+product_cache = LRUCache(
+    max_entries=PRODUCT_CACHE_MAX_ENTRIES,
+    ttl_seconds=PRODUCT_CACHE_TTL_SECONDS,
+    max_bytes=PRODUCT_CACHE_MAX_BYTES,
+    sizeof=_snapshot_size,
+)
+
+# desc: Put the current state of a product row into the cache
+def cache_product(product: models.Product):
+    product_cache.set(product.product_id, schemas.ProductDetail.from_orm(product))
+
+# desc: Read a product through the cache; the snapshot is detached from the session and must not be modified
+# return: Product snapshot, or None if the product does not exist
+def get_cached_product(product_id: int, db: Session):
+    def load():
+        product = db.query(models.Product).filter(models.Product.product_id == product_id).first()
+        return schemas.ProductDetail.from_orm(product) if product else None
+    return product_cache.get_or_load(product_id, load)
+
 current_seller_id = 86 
 
 def generate_seller_id() -> str:
@@ -81,23 +139,311 @@ def create_product(request: schemas.Create_Product, db: Session, current_seller:
     db.add(new_product)
     db.commit()
     db.refresh(new_product)
+    cache_product(new_product)
     return new_product
 
+# desc: Stream rows out of an uploaded CSV or NDJSON file without loading the whole file
+# return : yields (row_number, row) where row is a dict, or an error message for unreadable rows
+def _read_import_rows(file, file_format: str):
+    text_stream = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    if file_format == "csv":
+        for row_number, row in enumerate(csv.DictReader(text_stream), start=1):
+            # Empty cells mean "not set" so optional columns fall back to their defaults
+            yield row_number, {key: value for key, value in row.items() if key and value not in ("", None)}
+    else:
+        for row_number, line in enumerate(text_stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield row_number, f"Invalid JSON: {e}"
+                continue
+            yield row_number, row if isinstance(row, dict) else "Row must be a JSON object"
+
+# desc: Record a failed import row, keeping at most IMPORT_MAX_REPORTED_ERRORS messages
+def _import_error(report: dict, row_number: int, message: str):
+    report["failed"] += 1
+    if len(report["errors"]) < IMPORT_MAX_REPORTED_ERRORS:
+        report["errors"].append({"row": row_number, "error": message})
+
+# desc: Column values for a validated import row, computed the same way as create_product
+def _import_values(request: schemas.Create_Product, seller_id: int) -> dict:
+    values = request.dict(exclude={"product_id", "discounted_price"})
+    values["seller_id"] = seller_id
+    values["discounted_price"] = discount(float(request.price), float(request.discount or 0.0))
+    if request.launch_date is not None:
+        values["launch_date"] = request.launch_date.isoformat()
+    return values
+
+# desc: Validate one chunk of import rows, drop duplicate SKUs and insert the rest in one transaction
+def _import_chunk(chunk: list, db: Session, current_seller: models.seller, report: dict):
+    valid = []
+    for row_number, row in chunk:
+        if isinstance(row, str):
+            _import_error(report, row_number, row)
+            continue
+        try:
+            # product_id is assigned by the database and seller_id comes from the token
+            request = schemas.Create_Product(**{**row, "product_id": 0, "seller_id": current_seller.seller_id})
+        except ValidationError as e:
+            _import_error(report, row_number, "; ".join(
+                f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors()
+            ))
+            continue
+        valid.append((row_number, request))
+
+    # One query per chunk checks SKUs against the catalog, including rows committed by earlier chunks
+    skus = {request.sku for _, request in valid}
+    existing_skus = {sku for (sku,) in db.query(models.Product.sku).filter(models.Product.sku.in_(skus))} if skus else set()
+
+    rows, row_numbers = [], []
+    for row_number, request in valid:
+        if request.sku in existing_skus:
+            _import_error(report, row_number, "Product with this SKU already exists")
+            continue
+        existing_skus.add(request.sku)
+        rows.append(_import_values(request, current_seller.seller_id))
+        row_numbers.append(row_number)
+
+    if not rows:
+        return
+    try:
+        db.execute(models.Product.__table__.insert(), rows)
+        db.commit()
+        report["inserted"] += len(rows)
+    except SQLAlchemyError as e:
+        db.rollback()
+        for row_number in row_numbers:
+            _import_error(report, row_number, f"Insert failed: {e.__class__.__name__}")
+
+# desc: Import a seller's catalog from a CSV or NDJSON upload in fixed-size chunks
+# methods : POST
+# return : number of inserted and failed rows with a per-row error report
+def import_products(file, file_format: str, db: Session, current_seller: models.seller):
+    report = {"inserted": 0, "failed": 0, "errors": []}
+    chunk = []
+    for row_number, row in _read_import_rows(file, file_format):
+        chunk.append((row_number, row))
+        if len(chunk) >= IMPORT_CHUNK_SIZE:
+            _import_chunk(chunk, db, current_seller, report)
+            chunk = []
+    if chunk:
+        _import_chunk(chunk, db, current_seller, report)
+
+    report["errors_truncated"] = report["failed"] > len(report["errors"])
+    return report
+
+# desc: The changed_since value a client should pass to its next incremental export. Products changed
+#       in the last EXPORT_WATERMARK_LAG_SECONDS are exported again then, so the feed has to be idempotent.
+# return : ISO timestamp
+def export_watermark() -> str:
+    return (datetime.now() - timedelta(seconds=EXPORT_WATERMARK_LAG_SECONDS)).isoformat()
+
+# desc: Stream the catalog as NDJSON or CSV, reading the rows in EXPORT_BATCH_SIZE batches.
+#       With changed_since only products with updated_at at or after it are read; products that were
+#       never changed since updated_at was added have no updated_at and only appear in full exports.
+# methods : GET
+# return : generator of text chunks, one per batch
+def export_products(file_format: str, seller_id: int = None, changed_since: datetime = None):
+    # The stream outlives the request's session dependency, so the export owns its session
+    db = database.SessionLocal()
+    try:
+        columns = list(models.Product.__table__.columns)
+        names = [column.name for column in columns]
+        query = db.query(*columns)
+        if seller_id is not None:
+            query = query.filter(models.Product.seller_id == seller_id)
+        if changed_since is not None:
+            query = query.filter(models.Product.updated_at >= changed_since)
+        rows = query.order_by(models.Product.product_id).yield_per(EXPORT_BATCH_SIZE)
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer) if file_format == "csv" else None
+        if writer:
+            writer.writerow(names)
+        count = 0
+        for row in rows:
+            if writer:
+                writer.writerow(row)
+            else:
+                buffer.write(json.dumps(dict(zip(names, row)), default=str))
+                buffer.write("\n")
+            count += 1
+            if count % EXPORT_BATCH_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    finally:
+        db.close()
+
+# desc: Take quantity units of a product's stock only if that many are available, as one conditional UPDATE.
+#       Units reserved for other carts are not available; held is what the caller's own reservation held,
+#       which is released by the same UPDATE.
+# return : True if the stock was decremented, False if there was not enough
+def decrement_stock(db: Session, product_id: int, quantity: int, held: int = 0) -> bool:
+    table = models.Product.__table__
+    result = db.execute(
+        table.update()
+        .where(table.c.product_id == product_id, table.c.stock - table.c.reserved_stock + held >= quantity)
+        .values(stock=table.c.stock - quantity, reserved_stock=table.c.reserved_stock - held)
+    )
+    return result.rowcount == 1
+
 # desc: Get a single product by its ID
 # methods : GET
 # return : retrieves the product details
 def get_product(product_id: int, db: Session):
-    product = db.query(models.Product).filter(models.Product.product_id == product_id).first()
+    product = get_cached_product(product_id, db)
     if not product:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
     return product
 
-# desc: Retrieve all products from the database
+# desc: Get many products by ID, reading through the cache and loading all misses with one IN query
+# methods : GET, POST
+# return : the products in the requested order and the IDs that do not exist
+def get_products_batch(product_ids: list, db: Session):
+    if len(product_ids) > PRODUCT_BATCH_MAX_SIZE:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"At most {PRODUCT_BATCH_MAX_SIZE} product IDs per request")
+
+    def load(missing: list) -> dict:
+        rows = db.query(models.Product).filter(models.Product.product_id.in_(missing)).all()
+        return {row.product_id: schemas.ProductDetail.from_orm(row) for row in rows}
+
+    unique_ids = list(dict.fromkeys(product_ids))
+    found = product_cache.get_many_or_load(unique_ids, load)
+    return {
+        "items": [found[product_id] for product_id in unique_ids if product_id in found],
+        "missing": [product_id for product_id in unique_ids if product_id not in found],
+    }
+
+# desc: Fetch one keyset page of a product query ordered by sort_by, with product_id as the tie-breaker
+# return : (rows, next_cursor) where next_cursor is None on the last page
+def paginate_products(query, limit: int, cursor: str = None, sort_by: str = "product_id", descending: bool = False):
+    if sort_by not in SORT_COLUMNS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Cannot sort by {sort_by}")
+
+    key = SORT_COLUMNS[sort_by]
+    product_id = models.Product.product_id
+    order = (lambda column: column.desc()) if descending else (lambda column: column.asc())
+    after = (lambda column, value: column < value) if descending else (lambda column, value: column > value)
+
+    last_value = last_id = None
+    if cursor:
+        cursor_sort, last_value, last_id = pagination.decode_cursor(cursor, 3)
+        if cursor_sort != sort_by:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cursor does not match sort_by")
+
+    if key is product_id:
+        if cursor:
+            query = query.filter(after(product_id, last_id))
+        rows = query.order_by(order(product_id)).limit(limit + 1).all()
+    else:
+        # Rows with a value come first and rows where the sort key is NULL last, in both directions.
+        # Each segment is walked with its own range condition so both stay on the index.
+        rows = []
+        in_null_segment = cursor is not None and last_value is None
+        if not in_null_segment:
+            segment = query.filter(key.isnot(None))
+            if cursor:
+                segment = segment.filter(or_(after(key, last_value), and_(key == last_value, after(product_id, last_id))))
+            rows = segment.order_by(order(key), order(product_id)).limit(limit + 1).all()
+        if len(rows) <= limit:
+            segment = query.filter(key.is_(None))
+            if in_null_segment:
+                segment = segment.filter(after(product_id, last_id))
+            rows += segment.order_by(order(product_id)).limit(limit + 1 - len(rows)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = pagination.encode_cursor(sort_by, getattr(last, sort_by), last.product_id)
+    return rows, next_cursor
+
+# desc: Resolve a ?fields= value into the product columns to return
+# return : list of column names (product_id and version always first), or None to return whole products
+def parse_fields(fields: str = None):
+    if fields is None:
+        return None
+    if fields == "summary":
+        names = list(schemas.ProductSummary.model_fields)
+    else:
+        names = [name.strip() for name in fields.split(",") if name.strip()]
+
+    unknown = [name for name in names if name not in schemas.ProductFields.model_fields]
+    if unknown:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown fields: {', '.join(unknown)}")
+    return ["product_id", "version"] + [name for name in dict.fromkeys(names) if name not in ("product_id", "version")]
+
+# desc: Query whole products, or only the given columns so no ORM entities are hydrated
+def _product_query(db: Session, columns: list = None):
+    if columns is None:
+        return db.query(models.Product)
+    return db.query(*(getattr(models.Product, name) for name in columns))
+
+# desc: Turn column rows into dictionaries holding only the requested fields
+def _project(rows: list, fields: list = None) -> list:
+    if fields is None:
+        return rows
+    return [{name: getattr(row, name) for name in fields} for row in rows]
+
+# desc: Run a paginated product query that selects only the requested fields (plus the sort key)
+# return : (items, next_cursor)
+def _fetch_page(db: Session, conditions: list, fields: list, limit: int, cursor: str, sort_by: str, descending: bool):
+    columns = fields
+    if fields is not None and sort_by not in fields:
+        columns = fields + [sort_by]  # The keyset cursor needs the sort key of the last row
+    query = _product_query(db, columns).filter(*conditions)
+    rows, next_cursor = paginate_products(query, limit, cursor, sort_by, descending)
+    return _project(rows, fields), next_cursor
+
+# desc: Retrieve one page of products from the database
 # methods : GET
-# return : retrieves a list of all products
-def get_all_products(db: Session):
-    products = db.query(models.Product).all()
-    return products
+# return : a page of products and the cursor of the next page
+def get_all_products(db: Session, limit: int = pagination.DEFAULT_PAGE_SIZE, cursor: str = None,
+                     sort_by: str = "product_id", descending: bool = False, fields: str = None):
+    items, next_cursor = _fetch_page(db, [], parse_fields(fields), limit, cursor, sort_by, descending)
+    return {"items": items, "next_cursor": next_cursor}
+
+# desc: Build the filter conditions of a product search, optionally leaving one filter out
+# return : list of SQLAlchemy conditions
+def _search_conditions(filters: dict, exclude: str = None) -> list:
+    conditions = []
+    for name in ("category", "subcategory", "brand", "product_status", "featured"):
+        if name != exclude and filters.get(name) is not None:
+            conditions.append(getattr(models.Product, name) == filters[name])
+    if filters.get("min_price") is not None:
+        conditions.append(models.Product.price >= filters["min_price"])
+    if filters.get("max_price") is not None:
+        conditions.append(models.Product.price <= filters["max_price"])
+    return conditions
+
+# desc: Count matching products per value of a column, ignoring the filter on that same column
+# return : dictionary of value -> number of products
+def _facet_counts(db: Session, filters: dict, name: str) -> dict:
+    column = getattr(models.Product, name)
+    rows = db.query(column, func.count(models.Product.product_id)) \
+             .filter(*_search_conditions(filters, exclude=name), column.isnot(None)) \
+             .group_by(column).all()
+    return {value: count for value, count in rows}
+
+# desc: Filter products by category, subcategory, brand, price range, status and featured flag
+# methods : GET
+# return : one page of matching products plus per-brand and per-subcategory counts
+def search_products(db: Session, limit: int = pagination.DEFAULT_PAGE_SIZE, cursor: str = None,
+                    sort_by: str = "product_id", descending: bool = False, fields: str = None, **filters):
+    items, next_cursor = _fetch_page(db, _search_conditions(filters), parse_fields(fields), limit, cursor, sort_by, descending)
+
+    # Facets leave out their own filter so the client can offer the other brands/subcategories
+    facets = {
+        "brands": _facet_counts(db, filters, "brand"),
+        "subcategories": _facet_counts(db, filters, "subcategory"),
+    }
+    return {"items": items, "next_cursor": next_cursor, "facets": facets}
 
 # desc: Update an existing product
 # methods : PUT
@@ -134,10 +480,62 @@ def update_product(product_id: int, request: schemas.Create_Product, db: Session
     product.product_video = request.product_video or product.product_video
     product.tags = request.tags or product.tags
 
+    discounted_price = discount(float(product.price), float(product.discount or 0.0))
+    price_changed = discounted_price != product.discounted_price
+    product.discounted_price = discounted_price
+    if price_changed:
+        # Carts holding the product recompute their summary the next time it is read
+        get_cart_store().mark_stale(product_id, db)
+
     db.commit()
     db.refresh(product)
+    cache_product(product)
     return product
 
+# desc: Apply only the fields sent by the seller, as one UPDATE that also returns the new row
+# methods : PATCH
+# return : the updated product
+def patch_product(product_id: int, request: schemas.ProductPatch, db: Session, current_seller: models.seller):
+    values = request.dict(exclude_unset=True)
+    if not values:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No fields to update")
+
+    required = [name for name in ("product_name", "category", "price", "stock", "sku") if name in values and values[name] is None]
+    if required:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Fields cannot be null: {', '.join(required)}")
+
+    if values.get("launch_date") is not None:
+        values["launch_date"] = values["launch_date"].isoformat()
+
+    table = models.Product.__table__
+    if "price" in values and "discount" in values:
+        values["discounted_price"] = discount(float(values["price"]), float(values["discount"] or 0.0))
+    elif "price" in values or "discount" in values:
+        # Only one side was sent, so the other comes from the row being updated
+        price = literal(values["price"]) if "price" in values else table.c.price
+        discount_percent = literal(values["discount"] or 0.0) if "discount" in values else func.coalesce(table.c.discount, 0.0)
+        values["discounted_price"] = discount_expression(price, discount_percent)
+
+    statement = table.update() \
+        .where(table.c.product_id == product_id, table.c.seller_id == current_seller.seller_id) \
+        .values(**values)
+    if getattr(db.get_bind().dialect, "update_returning", False):
+        row = db.execute(statement.returning(*table.c)).first()
+    else:
+        result = db.execute(statement)
+        row = db.execute(select(table).where(table.c.product_id == product_id)).first() if result.rowcount else None
+
+    if row is None:
+        db.rollback()
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found or not authorized to update")
+    if "discounted_price" in values:
+        get_cart_store().mark_stale(product_id, db)
+    db.commit()
+
+    snapshot = schemas.ProductDetail.from_orm(row)
+    product_cache.set(product_id, snapshot)
+    return snapshot
+
 # desc: Delete a product from the database
 # methods : DELETE
 # return : deletes the product
@@ -147,17 +545,30 @@ def delete_product(product_id: int, db: Session, current_user: models.seller):
     if not product:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found or not authorized to delete")
     
+    # Before the delete, while the cart lines still point at the product
+    get_cart_store().mark_stale(product_id, db)
     db.delete(product)
     db.commit()
+    product_cache.invalidate(product_id)
     return {"detail": "Product deleted successfully"}
 
-# desc: search for a product from the database using product name
+# desc: search for products by name, brand, tags, category and description
 # methods : get
-# return : returns the product
-def get_product_by_name(product_name: str, db: Session):
-    # Use %product_name% for case-insensitive search
-    search_term = f"%{product_name}%"
-    product = db.query(models.Product).filter(models.Product.product_name.ilike(search_term)).all()
+# return : returns one page of matching products, best match first
+def get_product_by_name(product_name: str, db: Session, limit: int = pagination.DEFAULT_PAGE_SIZE, offset: int = 0,
+                        fields: str = None):
+    fields = parse_fields(fields)
+    if search.fts_enabled:
+        # Rank with the full-text index, then load the page of hits in a single query
+        product_ids = search.search_product_ids(db, product_name, limit, offset)
+        found = _product_query(db, fields).filter(models.Product.product_id.in_(product_ids)).all() if product_ids else []
+        by_id = {item.product_id: item for item in found}
+        product = [by_id[product_id] for product_id in product_ids if product_id in by_id]
+    else:
+        # Databases without FTS5 keep the case-insensitive %product_name% scan
+        search_term = f"%{product_name}%"
+        product = _product_query(db, fields).filter(models.Product.product_name.ilike(search_term)) \
+                    .order_by(models.Product.product_id).offset(offset).limit(limit).all()
     if not product:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
-    return product
\ No newline at end of file
+    return _project(product, fields)
\ No newline at end of file
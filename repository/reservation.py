@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from tele import models
+import os
+
+# How long stock stays held for a cart line after the line was added or grown
+RESERVATION_TTL_SECONDS = float(os.getenv("RESERVATION_TTL_SECONDS", "900"))
+
+products = models.Product.__table__
+reservations = models.Reservation.__table__
+
+
+# desc: Change a product's reserved_stock with one UPDATE. version and updated_at are set to themselves
+#       so the row's onupdate bumps do not fire: the product's ETag and export watermark are unchanged.
+# return: True if the row was updated (i.e. it exists and matched the extra condition)
+def _adjust_reserved(db: Session, product_id: int, change: int, condition=None) -> bool:
+    statement = products.update().where(products.c.product_id == product_id)
+    if condition is not None:
+        statement = statement.where(condition)
+    result = db.execute(statement.values(
+        reserved_stock=products.c.reserved_stock + change,
+        version=products.c.version,
+        updated_at=products.c.updated_at,
+    ))
+    return result.rowcount == 1
+
+
+# desc: Shrink or delete the user's reservation for a product, guarded on the quantity read so a
+#       concurrent checkout or sweep cannot release the same units twice
+# return: Number of units taken off the reservation
+def _remove(db: Session, user_id: int, product_id: int, quantity: int = None) -> int:
+    row = db.execute(
+        select(reservations.c.reservation_id, reservations.c.quantity)
+        .where(reservations.c.user_id == user_id, reservations.c.product_id == product_id)
+    ).first()
+    if row is None:
+        return 0
+
+    removed = row.quantity if quantity is None else min(quantity, row.quantity)
+    guard = (reservations.c.reservation_id == row.reservation_id, reservations.c.quantity == row.quantity)
+    if removed == row.quantity:
+        result = db.execute(reservations.delete().where(*guard))
+    else:
+        result = db.execute(reservations.update().where(*guard).values(quantity=row.quantity - removed))
+    return removed if result.rowcount == 1 else 0
+
+
+# desc: Hold quantity more units of a product for the user's cart and restart the hold's TTL. The
+#       product row is only updated if that many unreserved units are left. Runs in the caller's transaction.
+# return: True if the units were reserved
+def reserve(db: Session, user_id: int, product_id: int, quantity: int) -> bool:
+    if quantity <= 0:
+        # A negative hold would free stock that other carts could then oversell
+        raise ValueError(f"Reservation quantity must be positive, got {quantity}")
+    if not _adjust_reserved(db, product_id, quantity, products.c.stock - products.c.reserved_stock >= quantity):
+        return False
+
+    expires_at = datetime.now() + timedelta(seconds=RESERVATION_TTL_SECONDS)
+    result = db.execute(
+        reservations.update()
+        .where(reservations.c.user_id == user_id, reservations.c.product_id == product_id)
+        .values(quantity=reservations.c.quantity + quantity, expires_at=expires_at)
+    )
+    if not result.rowcount:
+        db.execute(reservations.insert().values(
+            user_id=user_id, product_id=product_id, quantity=quantity, expires_at=expires_at
+        ))
+    return True
+
+
+# desc: Give back quantity units (all of them by default) of the user's hold on a product.
+#       Runs in the caller's transaction.
+# return: Number of units released
+def release(db: Session, user_id: int, product_id: int, quantity: int = None) -> int:
+    released = _remove(db, user_id, product_id, quantity)
+    if released:
+        _adjust_reserved(db, product_id, -released)
+    return released
+
+
+# desc: Delete the user's reservation for a product at checkout. The caller passes the returned units
+#       to decrement_stock, which releases them in the same UPDATE that takes the stock.
+# return: Number of units the reservation held
+def take(db: Session, user_id: int, product_id: int) -> int:
+    return _remove(db, user_id, product_id)
+
+
+# desc: Release up to batch_size reservations that expired before now, in the caller's transaction
+# return: Number of reservations released
+def release_expired(db: Session, now: datetime, batch_size: int) -> int:
+    rows = db.execute(
+        select(reservations.c.reservation_id, reservations.c.product_id, reservations.c.quantity)
+        .where(reservations.c.expires_at < now)
+        .order_by(reservations.c.expires_at).limit(batch_size)
+    ).all()
+
+    released = {}
+    for row in rows:
+        result = db.execute(reservations.delete().where(
+            reservations.c.reservation_id == row.reservation_id, reservations.c.quantity == row.quantity
+        ))
+        if result.rowcount == 1:
+            released[row.product_id] = released.get(row.product_id, 0) + row.quantity
+
+    # One UPDATE per product, however many of its reservations expired
+    for product_id, quantity in released.items():
+        _adjust_reserved(db, product_id, -quantity)
+    return len(rows)
@@ -1,6 +1,8 @@
 from fastapi import HTTPException, status,Depends
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from tele import schemas, models,database,jwt_token
+from tele import schemas, models,database,jwt_token,pagination
+from repository.order import order_filters, paginate_orders
 from tele.hashing import Hash
 
 
@@ -107,21 +109,6 @@ def login(request: schemas.LoginRequest, db: Session = Depends(database.get_db))
     return {"access_token": access_token, "token_type": "bearer"}
 
 
-# desc: Retrieve all orders for a specific seller
-# params: seller_id (int), db (Session)
-# return: List of orders associated with the seller
-def get_seller_orders(seller_id: int, db: Session):
-    # Join Order and Product tables to get orders for products owned by the seller
-    seller_orders = db.query(models.Order).join(models.Product, models.Order.product_id == models.Product.product_id) \
-                    .filter(models.Product.seller_id == seller_id).all()
-
-    # If no orders found, raise an error
-    if not seller_orders:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No orders found for this seller")
-
-    return seller_orders
-
-
 def login(request: schemas.LoginRequest, db: Session = Depends(database.get_db)):
     seller = db.query(models.seller).filter(models.seller.email_id == request.email_id).first()
 
@@ -140,12 +127,22 @@ def login(request: schemas.LoginRequest, db: Session = Depends(database.get_db))
     return {"access_token": access_token, "token_type": "bearer"}
 
 
-def get_seller_orders(seller_id: int, db: Session):
-    # Join Order and Product tables to get orders for products owned by the seller
-    seller_orders = db.query(models.Order).join(models.Product, models.Order.product_id == models.Product.product_id) \
-                    .filter(models.Product.seller_id == seller_id).all()
-
-    if not seller_orders:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No orders found for this seller")
-
-    return seller_orders
\ No newline at end of file
+# desc: Retrieve one page of the orders for a seller's products, newest first
+# params: seller_id (int), db (Session), limit, cursor and the order filters
+# return: A page of orders matching the filters and the cursor of the next page
+def get_seller_orders(seller_id: int, db: Session, limit: int = pagination.DEFAULT_PAGE_SIZE, cursor: str = None,
+                      include_archived: bool = False, **filters):
+    # Orders with at least one line for a product owned by the seller (indexed on seller_id and on the lines' product_id)
+    seller_products = select(models.Product.product_id).where(models.Product.seller_id == seller_id)
+    order_ids = select(models.OrderItem.order_id).where(models.OrderItem.product_id.in_(seller_products))
+    query = db.query(models.Order).filter(models.Order.order_id.in_(order_ids), *order_filters(**filters))
+    archive_query = None
+    if include_archived:
+        archived_ids = select(models.OrderItemArchive.order_id) \
+                         .where(models.OrderItemArchive.product_id.in_(seller_products))
+        archive_query = db.query(models.OrderArchive) \
+                          .filter(models.OrderArchive.order_id.in_(archived_ids),
+                                  *order_filters(**filters, model=models.OrderArchive))
+    seller_orders, next_cursor = paginate_orders(query, limit, cursor, archive_query)
+
+    return {"items": seller_orders, "next_cursor": next_cursor}
\ No newline at end of file
@@ -0,0 +1,137 @@
+# Background cleanup of data that expires: abandoned cart lines, stock reservations and idempotency keys,
+# and archival of old finished orders.
+# usage: python -m repository.sweeper [--ttl-days N] [--batch-size N]
+# With CART_STORE=memory, carts live in the application process, so run the sweeper in-process there.
+import argparse
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from tele import database, models, idempotency
+from repository.cart_store import get_cart_store
+from repository import reservation, order_archive
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+CART_TTL_DAYS = float(os.getenv("CART_TTL_DAYS", "30"))  # Cart lines added longer ago than this are expired
+SWEEP_INTERVAL_SECONDS = float(os.getenv("SWEEP_INTERVAL_SECONDS", "3600"))  # 0 disables the in-process sweeper
+SWEEP_BATCH_SIZE = int(os.getenv("SWEEP_BATCH_SIZE", "1000"))  # Rows deleted per transaction
+
+
+# desc: Call step(db) in its own transaction until it handles fewer than batch_size rows, so no
+#       table is locked for long
+# return: Total number of rows handled
+def _in_batches(step, batch_size: int) -> int:
+    total = 0
+    while True:
+        db = database.SessionLocal()
+        try:
+            handled = step(db)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        total += handled
+        if handled < batch_size:
+            return total
+
+
+# desc: Delete cart lines added before cutoff. Summaries of the affected carts are dropped and
+#       recomputed on next read.
+# return: Number of cart rows deleted from the database
+def expire_cart_lines(cutoff: datetime, batch_size: int) -> int:
+    def step(db) -> int:
+        # Served by the added_date index, oldest lines first
+        rows = db.query(models.Cart.cart_id, models.Cart.user_id) \
+                 .filter(models.Cart.added_date < cutoff) \
+                 .order_by(models.Cart.added_date).limit(batch_size).all()
+        if rows:
+            db.query(models.Cart).filter(models.Cart.cart_id.in_([row.cart_id for row in rows])) \
+              .delete(synchronize_session=False)
+            db.query(models.CartSummary).filter(models.CartSummary.user_id.in_({row.user_id for row in rows})) \
+              .delete(synchronize_session=False)
+        return len(rows)
+
+    return _in_batches(step, batch_size)
+
+
+# desc: Run one sweep over every kind of expiring data
+# return: Report with the rows removed and the time the sweep took
+def run_sweep(ttl_days: float = CART_TTL_DAYS, batch_size: int = SWEEP_BATCH_SIZE) -> dict:
+    started = time.perf_counter()
+    cutoff = datetime.now() - timedelta(days=ttl_days)
+
+    # Expire lines held in memory first, so a later flush does not write them back
+    cart_lines_in_memory = get_cart_store().expire_lines(cutoff)
+    cart_rows = expire_cart_lines(cutoff, batch_size)
+    now = datetime.now()
+    reservations = _in_batches(lambda db: reservation.release_expired(db, now, batch_size), batch_size)
+    idempotency_keys = _in_batches(lambda db: idempotency.purge_expired(db, now, batch_size), batch_size)
+    archived_orders = 0
+    if order_archive.ORDER_ARCHIVE_AFTER_DAYS > 0:
+        archive_cutoff = now - timedelta(days=order_archive.ORDER_ARCHIVE_AFTER_DAYS)
+        archived_orders = _in_batches(lambda db: order_archive.archive_orders(db, archive_cutoff, batch_size), batch_size)
+
+    report = {
+        "cart_rows": cart_rows,
+        "cart_lines_in_memory": cart_lines_in_memory,
+        "reservations": reservations,
+        "idempotency_keys": idempotency_keys,
+        "archived_orders": archived_orders,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+    logger.info(f"Sweep finished: {report}")
+    return report
+
+
+# desc: Runs run_sweep every interval seconds in a background thread
+class Sweeper:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.last_report = None
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None and self.interval > 0:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="sweeper", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.last_report = run_sweep()
+            except Exception as e:
+                logger.error(f"Sweep failed: {e}")
+
+
+sweeper = Sweeper(SWEEP_INTERVAL_SECONDS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Expire abandoned cart lines and their stock reservations, purge "
+                                                 "old idempotency keys and archive finished orders")
+    parser.add_argument("--ttl-days", type=float, default=CART_TTL_DAYS)
+    parser.add_argument("--batch-size", type=int, default=SWEEP_BATCH_SIZE)
+    args = parser.parse_args()
+
+    database.init_db()
+    report = run_sweep(args.ttl_days, args.batch_size)
+    print(f"removed {report['cart_rows']} cart rows, released {report['reservations']} reservations, purged "
+          f"{report['idempotency_keys']} idempotency keys and archived {report['archived_orders']} orders "
+          f"in {report['duration_ms']} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 from fastapi import HTTPException, status, Depends
 from sqlalchemy.orm import Session
-from tele import schemas, models, database, jwt_token
+from tele import schemas, models, database, jwt_token, pagination
+from repository.order import order_filters, paginate_orders
 from tele.hashing import Hash
 from fastapi.security import OAuth2PasswordRequestForm
 
@@ -144,14 +145,18 @@ def update_password(
     
     return {"message": "Password updated successfully!"}  # Return success message
 
-# desc: Retrieve all orders for a specific user
+# desc: Retrieve one page of a user's orders, newest first
 # methods: GET
-# return: List of all orders by the user
-def get_user_orders(user_id: int, db: Session):
-    # Query the Order table to get all orders by the user
-    user_orders = db.query(models.Order).filter(models.Order.user_id == user_id).all()
-
-    if not user_orders:
-        raise HTTPException(status_code=404, detail="No orders found for this user")  # Raise an error if no orders found
+# return: A page of the user's orders matching the filters and the cursor of the next page
+def get_user_orders(user_id: int, db: Session, limit: int = pagination.DEFAULT_PAGE_SIZE, cursor: str = None,
+                    include_archived: bool = False, **filters):
+    # Served by the (user_id, order_date) index
+    query = db.query(models.Order).filter(models.Order.user_id == user_id, *order_filters(**filters))
+    archive_query = None
+    if include_archived:
+        archive_query = db.query(models.OrderArchive).filter(
+            models.OrderArchive.user_id == user_id, *order_filters(**filters, model=models.OrderArchive)
+        )
+    user_orders, next_cursor = paginate_orders(query, limit, cursor, archive_query)
 
-    return user_orders  # Return the list of user orders
+    return {"items": user_orders, "next_cursor": next_cursor}  # Return the page of user orders
@@ -1,8 +1,8 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Response
 from sqlalchemy.orm import Session
-from tele import schemas, database, oauth2,models
+from tele import schemas, database, oauth2,models,idempotency
 from repository import cart
-from typing import List,Dict
+from typing import List,Dict,Optional
 
 router = APIRouter(
     prefix="/cart",
@@ -32,13 +32,24 @@ def read_cart(
 ):
     return cart.get_cart_items(current_user.user_id, db)
 
+# desc: Setting the route to apply many cart changes at once
+# method: POST
+# return: Applies all add/update/remove operations in one transaction and returns the resulting cart
+@router.post("/batch", response_model=schemas.CartResponse)
+def apply_cart_batch(
+    request: schemas.CartBatchRequest,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(oauth2.get_current_user)
+):
+    return cart.apply_cart_batch(request, user_id=current_user.user_id, db=db)
+
 # desc: Setting the route to update an item in the cart
 # method: PUT
 # return: Updates the quantity of the specified cart item and returns the updated cart item details
 @router.put("/update/{cart_id}", response_model=schemas.Cart)
 def update_cart_item(
     cart_id: int,
-    quantity: int,
+    quantity: int = Query(gt=0),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(oauth2.get_current_user)
 ):
@@ -65,12 +76,28 @@ def calculate_total(
 ):
     return cart.calculate_cart_total(user_id=current_user.user_id, db=db)
 
+# desc: Setting the route to get the cart summary shown in the header badge
+# method: GET
+# return: Returns the line count, item count, total price and last change of the user's cart
+@router.get("/summary", response_model=schemas.CartSummary)
+def read_cart_summary(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(oauth2.get_current_user)
+):
+    return cart.get_cart_summary(current_user.user_id, db)
+
 # desc: Setting the route to order all items in the cart
 # method: POST
-# return: Places an order for all items in the user's cart
+# return: Places an order for all items in the user's cart; a retry with the same Idempotency-Key
+#         returns the first response instead of checking out again
 @router.post("/order")
 def order_all_cart_items(
+    response: Response,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(oauth2.get_current_user)
+    current_user: models.User = Depends(oauth2.get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
-    return cart.order_cart(user_id=current_user.user_id, db=db)
\ No newline at end of file
+    return idempotency.run_once(
+        db, current_user.user_id, idempotency_key, idempotency.request_hash("POST /cart/order"),
+        lambda: cart.order_cart(user_id=current_user.user_id, db=db), response
+    )
\ No newline at end of file
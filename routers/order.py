@@ -1,21 +1,29 @@
-from fastapi import APIRouter, Depends, status
+from fastapi import APIRouter, Depends, Header, Query, Response, status
 from sqlalchemy.orm import Session
-from tele import schemas, database, oauth2
+from tele import schemas, database, oauth2, idempotency
+from tele.jobs import job_queue
 from repository import order
+from typing import Optional
 
 # Initialize the router for Order operations
 router = APIRouter(tags=["Orders"], prefix='/orders')
 
 # desc: Route to create a new order
 # method: POST
-# return: Creates a new order and returns the order response
+# return: Creates a new order and returns the order response; a retry with the same Idempotency-Key
+#         returns the first response instead of placing another order
 @router.post("/all", response_model=schemas.OrderResponse)
 def create_order(
     request: schemas.OrderCreate, 
+    response: Response,
     db: Session = Depends(database.get_db), 
-    current_user: schemas.Create_User = Depends(oauth2.get_current_user)  # Ensure the current user is authenticated
+    current_user: schemas.Create_User = Depends(oauth2.get_current_user),  # Ensure the current user is authenticated
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
-    return order.create_order(request, current_user.user_id, db)
+    return idempotency.run_once(
+        db, current_user.user_id, idempotency_key, idempotency.request_hash("POST /orders/all", request),
+        lambda: order.create_order(request, current_user.user_id, db), response
+    )
 
 # desc: Route to get details of a specific order by ID
 # method: GET
@@ -23,9 +31,21 @@ def create_order(
 @router.get("/{order_id}", response_model=schemas.OrderResponse)
 def get_order(
     order_id: int,
-    db: Session = Depends(database.get_db)
+    db: Session = Depends(database.get_db),
+    include_archived: bool = Query(False, description="Also look in the archive of old orders")
 ):
-    return order.get_order_by_id(order_id, db)
+    return order.get_order_by_id(order_id, db, include_archived)
+
+# desc: Route to track a parcel by its tracking number
+# method: GET
+# return: Retrieves the order with the given tracking number
+@router.get("/track/{tracking_number}", response_model=schemas.OrderResponse)
+def track_order(
+    tracking_number: str,
+    db: Session = Depends(database.get_db),
+    include_archived: bool = Query(False, description="Also look in the archive of old orders")
+):
+    return order.get_order_by_tracking_number(tracking_number, db, include_archived)
 
 # desc: Route to update an existing order
 # method: PUT
@@ -38,6 +58,16 @@ def update_order(
 ):
     return order.update_order(order_id, request, db)
 
+# desc: Route to update many orders at once (e.g. a shipping wave)
+# method: POST
+# return: Counts of updated, missing and failed orders and the outcome of each order
+@router.post("/bulk", response_model=schemas.OrderBulkResult)
+def bulk_update_orders(
+    request: schemas.OrderBulkUpdate,
+    db: Session = Depends(database.get_db)
+):
+    return order.bulk_update_orders(request, db)
+
 # desc: Route to delete an existing order
 # method: DELETE
 # return: Deletes the specified order
@@ -58,3 +88,10 @@ def pay_order(
     db: Session = Depends(database.get_db)
 ):
     return order.pay_order(order_id, request, db)
+
+# desc: Route to read the background job queue metrics
+# method: GET
+# return: Queue depth per status, age of the oldest pending job and the worker counters
+@router.get("/jobs/stats")
+def get_job_stats():
+    return job_queue.stats()
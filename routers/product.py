@@ -1,13 +1,18 @@
-from fastapi import APIRouter, Depends, status, Body
+from fastapi import APIRouter, Depends, status, Body, Query, File, UploadFile, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from tele import schemas, models, oauth2
+from tele import schemas, models, oauth2, pagination, conditional
 from repository import product  
 from tele.database import get_db
-from typing import List
+from typing import List, Literal, Optional
+from datetime import datetime
 
 # Initialize the router for Product operations
 router = APIRouter(tags=["Product"], prefix='/products')
 
+FIELDS_DESCRIPTION = ("Comma-separated product fields to return, or 'summary' for the compact listing view. "
+                      "product_id and version are always included")
+
 # desc: Route to create and store a new product
 # method: POST
 # return: Stores the product details in the database
@@ -19,6 +24,27 @@ def create_product(
 ):
     return product.create_product(request, db, current_user)
 
+# desc: Route to import many products at once from a CSV or NDJSON file
+# method: POST
+# return: Number of imported rows and the errors of the rejected ones
+@router.post("/import", response_model=schemas.ProductImportReport)
+def import_products(
+    file: UploadFile = File(...),
+    format: Optional[Literal["csv", "ndjson"]] = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(oauth2.get_current_seller)  # Ensure the current user is a seller
+):
+    file_format = format
+    if file_format is None:
+        filename = (file.filename or "").lower()
+        if filename.endswith(".csv"):
+            file_format = "csv"
+        elif filename.endswith((".ndjson", ".jsonl")):
+            file_format = "ndjson"
+        else:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Pass format=csv or format=ndjson")
+    return product.import_products(file.file, file_format, db, current_user)
+
 # desc: Route to update an existing product
 # method: PUT
 # return: Updates the product details in the database
@@ -31,6 +57,18 @@ def update_product(
 ):
     return product.update_product(product_id, request, db, current_user)
 
+# desc: Route to change only some fields of a product
+# method: PATCH
+# return: The updated product
+@router.patch("/{product_id}", response_model=schemas.ProductDetail)
+def patch_product(
+    product_id: int,
+    request: schemas.ProductPatch,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(oauth2.get_current_seller)  # Ensure the current user is a seller
+):
+    return product.patch_product(product_id, request, db, current_user)
+
 # desc: Route to delete a product
 # method: DELETE
 # return: Deletes the product from the database
@@ -42,29 +80,133 @@ def delete_product(
 ):
     return product.delete_product(product_id, db, current_user)
 
+# desc: Route to filter products for the storefront
+# method: GET
+# return: One page of matching products with per-brand and per-subcategory counts
+@router.get("/search", response_model=schemas.ProductSearchPage, response_model_exclude_unset=True)
+def search_products(
+    category: Optional[str] = None,
+    subcategory: Optional[str] = None,
+    brand: Optional[str] = None,
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    product_status: Optional[str] = None,
+    featured: Optional[bool] = None,
+    limit: int = Query(pagination.DEFAULT_PAGE_SIZE, ge=1, le=pagination.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    sort_by: Literal["product_id", "price", "rating", "launch_date"] = "product_id",
+    order: Literal["asc", "desc"] = "asc",
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    db: Session = Depends(get_db)
+):
+    return product.search_products(
+        db, limit=limit, cursor=cursor, sort_by=sort_by, descending=order == "desc", fields=fields,
+        category=category, subcategory=subcategory, brand=brand, min_price=min_price,
+        max_price=max_price, product_status=product_status, featured=featured
+    )
+
+# desc: Route to export the catalog for downstream feeds
+# method: GET
+# return: Streams every matching product as NDJSON (default) or CSV
+@router.get("/export")
+def export_products(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    seller_id: Optional[int] = None,
+    changed_since: Optional[datetime] = Query(
+        None, description="Only products updated at or after this time (products never updated since "
+                          "updated_at was added have none and are only in full exports)"
+    ),
+):
+    # Clients pass this back as changed_since to fetch the next incremental feed; it trails the export
+    # so changes still committing while it runs are picked up next time
+    watermark = product.export_watermark()
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        product.export_products(format, seller_id=seller_id, changed_since=changed_since),
+        media_type=media_type,
+        headers={"X-Export-Watermark": watermark},
+    )
+
+# desc: Route to get many products by ID in one request
+# method: GET
+# return: The products in the requested order and the IDs that were not found
+@router.get("/batch", response_model=schemas.ProductBatchResponse)
+def get_products_batch(
+    ids: str = Query(..., description="Comma-separated product IDs"),
+    db: Session = Depends(get_db)
+):
+    try:
+        product_ids = [int(value) for value in ids.split(",") if value.strip()]
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ids must be comma-separated integers")
+    return product.get_products_batch(product_ids, db)
+
+# desc: Route to get many products by ID, for ID lists too long for a query string
+# method: POST
+# return: The products in the requested order and the IDs that were not found
+@router.post("/batch", response_model=schemas.ProductBatchResponse)
+def post_products_batch(
+    request: schemas.ProductBatchRequest,
+    db: Session = Depends(get_db)
+):
+    return product.get_products_batch(request.ids, db)
+
+# desc: Route to inspect the product read cache
+# method: GET
+# return: Cache size and hit/miss/eviction counters
+@router.get("/cache/stats")
+def get_cache_stats():
+    return product.product_cache.stats()
+
 # desc: Route to get details of a single product
 # method: GET
 # return: Retrieves product details
-@router.get("/{product_id}", response_model=schemas.Create_Product)
+@router.get("/{product_id}", response_model=schemas.ProductDetail)
 def get_product(
     product_id: int,
+    request: Request,
+    response: Response,
     db: Session = Depends(get_db)
 ):
-    return product.get_product(product_id, db)
+    item = product.get_product(product_id, db)
+    headers = conditional.validator_headers(conditional.product_etag(item.product_id, item.version), item.updated_at)
+    if conditional.is_not_modified(request, headers["ETag"], item.updated_at):
+        return conditional.not_modified(headers)
+    response.headers.update(headers)
+    return item
 
-# desc: Route to get a list of all products
+# desc: Route to get a page of products
 # method: GET
-# return: Retrieves a list of all products
-@router.get("", response_model=List[schemas.Create_Product])
-def get_all_products(db: Session = Depends(get_db)):
-    return product.get_all_products(db)
+# return: Retrieves one page of products and the cursor for the next page
+@router.get("", response_model=schemas.ProductPage, response_model_exclude_unset=True)
+def get_all_products(
+    request: Request,
+    response: Response,
+    limit: int = Query(pagination.DEFAULT_PAGE_SIZE, ge=1, le=pagination.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    sort_by: Literal["product_id", "price", "rating", "launch_date"] = "product_id",
+    order: Literal["asc", "desc"] = "asc",
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    db: Session = Depends(get_db)
+):
+    page = product.get_all_products(db, limit=limit, cursor=cursor, sort_by=sort_by, descending=order == "desc",
+                                    fields=fields)
+    etag, last_modified = conditional.page_validators(page["items"])
+    headers = conditional.validator_headers(etag, last_modified)
+    if conditional.is_not_modified(request, etag, last_modified):
+        return conditional.not_modified(headers)
+    response.headers.update(headers)
+    return page
 
-# desc: Route to get products by their name
+# desc: Route to search products by name, brand, tags, category and description
 # method: GET
-# return: Retrieves a list of products that match the given name
-@router.get("/get/{product_name}", response_model=List[schemas.Create_Product])
+# return: Retrieves one page of matching products, best match first
+@router.get("/get/{product_name}", response_model=List[schemas.ProductFields], response_model_exclude_unset=True)
 def get_product_by_name(
     product_name: str,
+    limit: int = Query(pagination.DEFAULT_PAGE_SIZE, ge=1, le=pagination.MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
     db: Session = Depends(get_db)
 ):
-    return product.get_product_by_name(product_name, db)
+    return product.get_product_by_name(product_name, db, limit=limit, offset=offset, fields=fields)
@@ -1,9 +1,11 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from sqlalchemy.orm import Session
-from tele import schemas, database, models, oauth2
-from repository import seller  
+from tele import schemas, database, models, oauth2, pagination
+from repository import seller, analytics
 from tele.schemas import seller_User
 from tele.database import get_db
+from typing import Optional
+from datetime import date, datetime
 
 # Initialize the router for the Seller operations
 router = APIRouter(tags=["Seller"], prefix='/Seller')
@@ -22,12 +24,34 @@ def create_user(request: seller_User, db: Session = Depends(get_db)):
 def login(request: schemas.LoginRequest, db: Session = Depends(database.get_db)):
     return seller.login(request, db)
 
-# desc: Route to retrieve orders for the current seller
+# desc: Route to retrieve orders for the current seller, newest first, one page at a time
 # methods: GET
-# return: List of orders for the current seller
-@router.get("/orders/me", response_model=list[schemas.OrderResponse])
+# return: A page of orders for the current seller and the cursor of the next page
+@router.get("/orders/me", response_model=schemas.OrderPage)
 def get_my_orders(
     current_seller: models.seller = Depends(oauth2.get_current_seller),  # Get the currently logged-in seller
-    db: Session = Depends(database.get_db)
+    db: Session = Depends(database.get_db),
+    limit: int = Query(pagination.DEFAULT_PAGE_SIZE, ge=1, le=pagination.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    order_status: Optional[str] = None,
+    payment_status: Optional[str] = None,
+    date_from: Optional[datetime] = Query(None, description="Only orders placed at or after this time"),
+    date_to: Optional[datetime] = Query(None, description="Only orders placed before this time"),
+    include_archived: bool = Query(False, description="Also read old orders from the archive")
 ):
-    return seller.get_seller_orders(current_seller.seller_id, db)  # Fetch orders for the current seller
+    # Fetch a page of orders for the current seller
+    return seller.get_seller_orders(current_seller.seller_id, db, limit, cursor, include_archived, order_status=order_status,
+                                    payment_status=payment_status, date_from=date_from, date_to=date_to)
+
+# desc: Route to read the current seller's sales per product and day
+# methods: GET
+# return: Daily order counts, units and revenue from the sales rollup, with their totals
+@router.get("/analytics/sales", response_model=schemas.SellerSales)
+def get_my_sales(
+    current_seller: models.seller = Depends(oauth2.get_current_seller),
+    db: Session = Depends(database.get_db),
+    date_from: Optional[date] = Query(None, description="First day to include, 30 days before date_to by default"),
+    date_to: Optional[date] = Query(None, description="Last day to include"),
+    product_id: Optional[int] = None
+):
+    return analytics.get_seller_sales(db, current_seller.seller_id, date_from, date_to, product_id)
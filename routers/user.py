@@ -1,11 +1,13 @@
-from fastapi import APIRouter, Depends,status,Body
+from fastapi import APIRouter, Depends,status,Body,Query
 from sqlalchemy.orm import Session
-from tele import schemas,database,models,oauth2
+from tele import schemas,database,models,oauth2,pagination
 from repository import user
 from tele.database import get_db 
 from tele.oauth2 import get_current_user
 from tele.schemas import Create_User
 from fastapi.security import OAuth2PasswordRequestForm
+from typing import Optional
+from datetime import datetime
 
 router = APIRouter(prefix='/user',tags=["User"],)
 
@@ -86,11 +88,19 @@ def update_password(
 ):
     return user.update_password(request, current_user, db)
 
-# desc:setting the route to retrive all the orders done by the uses
+# desc:setting the route to retrive the orders done by the uses, newest first, one page at a time
 # methods : GET
-#return : Gets the current user orders
-@router.get("/orders/me", response_model=list[schemas.OrderResponse])
+#return : Gets a page of the current user orders and the cursor of the next page
+@router.get("/orders/me", response_model=schemas.OrderPage)
 def get_my_orders(current_user: models.User = Depends(oauth2.get_current_user),
-                   db: Session = Depends(database.get_db)):
+                   db: Session = Depends(database.get_db),
+                   limit: int = Query(pagination.DEFAULT_PAGE_SIZE, ge=1, le=pagination.MAX_PAGE_SIZE),
+                   cursor: Optional[str] = None,
+                   order_status: Optional[str] = None,
+                   payment_status: Optional[str] = None,
+                   date_from: Optional[datetime] = Query(None, description="Only orders placed at or after this time"),
+                   date_to: Optional[datetime] = Query(None, description="Only orders placed before this time"),
+                   include_archived: bool = Query(False, description="Also read old orders from the archive")):
     # Get the orders of the current logged-in user
-    return user.get_user_orders(current_user.user_id, db)
\ No newline at end of file
+    return user.get_user_orders(current_user.user_id, db, limit, cursor, include_archived, order_status=order_status,
+                                payment_status=payment_status, date_from=date_from, date_to=date_to)
\ No newline at end of file
@@ -0,0 +1,138 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+# desc: Thread-safe in-process LRU cache with a TTL, an entry limit and an approximate memory limit.
+#       The cache is local to the process, so writers must call set/invalidate to keep it coherent.
+class LRUCache:
+    def __init__(self, max_entries: int, ttl_seconds: float, max_bytes: int = None, sizeof=sys.getsizeof):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._entries = OrderedDict()  # key -> (value, expires_at, size)
+        self._lock = threading.Lock()
+        self._generation = 0  # Bumped on every write and invalidation, see get_or_load
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    # desc: Drop an entry; the caller must hold the lock
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self.current_bytes -= size
+
+    # desc: Look up a live entry and mark it as recently used
+    # return: The cached value, or default on a miss
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at, _ = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    # desc: Store a value, evicting the least recently used entries while over the limits. Loads that
+    #       started before this write do not store their (possibly older) value over it.
+    def set(self, key, value):
+        size = self._sizeof(value)
+        with self._lock:
+            self._generation += 1
+            self._store(key, value, size)
+
+    # desc: Insert an entry and enforce the limits; the caller must hold the lock
+    def _store(self, key, value, size):
+        if key in self._entries:
+            self._remove(key)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        self._entries[key] = (value, time.monotonic() + self.ttl_seconds, size)
+        self.current_bytes += size
+        while len(self._entries) > self.max_entries or (
+            self.max_bytes is not None and self.current_bytes > self.max_bytes
+        ):
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self.current_bytes -= evicted_size
+            self.evictions += 1
+
+    # desc: Read through the cache, calling loader() on a miss and caching a non-None result
+    # return: The cached or freshly loaded value
+    def get_or_load(self, key, loader):
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            generation = self._generation
+        value = loader()
+        if value is not None:
+            size = self._sizeof(value)
+            with self._lock:
+                # Skip the store if something was written or invalidated while loading, the value may be stale
+                if generation == self._generation:
+                    self._store(key, value, size)
+        return value
+
+    # desc: Read many keys through the cache, calling loader(missing_keys) once for all misses
+    # return: Dictionary of key -> value for every key that was cached or loaded
+    def get_many_or_load(self, keys, loader) -> dict:
+        found = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                found[key] = value
+
+        missing = [key for key in keys if key not in found]
+        if missing:
+            with self._lock:
+                generation = self._generation
+            loaded = loader(missing)
+            sizes = {key: self._sizeof(value) for key, value in loaded.items()}
+            with self._lock:
+                if generation == self._generation:
+                    for key, value in loaded.items():
+                        self._store(key, value, sizes[key])
+            found.update(loaded)
+        return found
+
+    # desc: Remove an entry after the underlying data changed
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            if key in self._entries:
+                self._remove(key)
+
+    # desc: Remove every entry
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self.current_bytes = 0
+
+    # desc: Snapshot of the cache counters
+    # return: Dictionary of sizes and hit/miss/eviction counts
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
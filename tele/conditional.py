@@ -0,0 +1,62 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from fastapi import Request, Response, status
+
+
+# desc: Strong ETag of a single product, derived from its row version
+def product_etag(product_id: int, version: int) -> str:
+    return f'"{product_id}-{version}"'
+
+
+# desc: Strong ETag of a page of products, derived from the (product_id, version) pairs it contains
+def page_etag(pairs) -> str:
+    digest = hashlib.sha1(",".join(f"{product_id}:{version}" for product_id, version in pairs).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+# desc: ETag and Last-Modified of a page of products, given as ORM rows or as ?fields= dictionaries
+# return: (etag, last_modified) where last_modified is None if no item carries updated_at
+def page_validators(items) -> tuple:
+    def field(item, name):
+        return item.get(name) if isinstance(item, dict) else getattr(item, name, None)
+
+    etag = page_etag((field(item, "product_id"), field(item, "version")) for item in items)
+    modified = [field(item, "updated_at") for item in items if field(item, "updated_at") is not None]
+    return etag, max(modified) if modified else None
+
+
+# desc: Build the ETag and Last-Modified headers of a response
+# return: Dictionary of headers (Last-Modified only when the time is known)
+def validator_headers(etag: str, last_modified: datetime = None) -> dict:
+    headers = {"ETag": etag}
+    if last_modified is not None:
+        # Naive timestamps are written with datetime.now(), i.e. local time
+        headers["Last-Modified"] = format_datetime(last_modified.astimezone(timezone.utc), usegmt=True)
+    return headers
+
+
+# desc: Evaluate If-None-Match / If-Modified-Since against the current validators
+# return: True if the client's copy is still current and a 304 can be sent
+def is_not_modified(request: Request, etag: str, last_modified: datetime = None) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match takes precedence over If-Modified-Since when both are sent
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return last_modified.astimezone(timezone.utc).replace(microsecond=0) <= since
+    return False
+
+
+# desc: Empty 304 response carrying the validators
+def not_modified(headers: dict) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
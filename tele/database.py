@@ -1,7 +1,9 @@
+import logging
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import bindparam, create_engine, func, inspect, select, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.schema import CreateTable
 from sqlalchemy.exc import SQLAlchemyError
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./user.db")
@@ -10,6 +12,9 @@ engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Set up logging
+logger = logging.getLogger(__name__)
+
 def get_db():
     db = SessionLocal()
     try:
@@ -20,5 +25,92 @@ def get_db():
     finally:
         db.close()
 
+# desc: Add columns that were added to a model after its table was created
+def add_missing_columns():
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}"
+            if column.server_default is not None:
+                ddl += f" DEFAULT {column.server_default.arg}"
+            with engine.begin() as connection:
+                connection.execute(text(ddl))
+
+# desc: Rebuild SQLite tables declared with sqlite_autoincrement that were created without it, so their
+#       IDs are never handed out again. The sequence starts after the highest ID of the table and of the
+#       tables listed in its info["sequence_shared_with"]. Indexes are dropped with the old table and
+#       recreated by init_db.
+def add_missing_autoincrement():
+    if engine.dialect.name != "sqlite":
+        return
+    preparer = engine.dialect.identifier_preparer
+    for table in Base.metadata.sorted_tables:
+        if not table.dialect_options["sqlite"]["autoincrement"]:
+            continue
+        with engine.begin() as connection:
+            sql = connection.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                                     {"name": table.name}).scalar()
+            if sql is None or "AUTOINCREMENT" in sql.upper():
+                continue
+            rebuild = f"{table.name}_rebuild"
+            ddl = str(CreateTable(table).compile(dialect=engine.dialect)).strip()
+            connection.execute(text(ddl.replace(f"CREATE TABLE {preparer.format_table(table)} ",
+                                                f"CREATE TABLE {preparer.quote(rebuild)} ", 1)))
+            columns = ", ".join(preparer.quote(column.name) for column in table.columns)
+            connection.execute(text(f"INSERT INTO {preparer.quote(rebuild)} ({columns}) "
+                                    f"SELECT {columns} FROM {preparer.format_table(table)}"))
+
+            key = preparer.quote(table.primary_key.columns.values()[0].name)
+            highest = [f"SELECT max({key}) FROM {preparer.quote(name)}"
+                       for name in (rebuild, *table.info.get("sequence_shared_with", ()))]
+            floor = max((connection.execute(text(query)).scalar() or 0) for query in highest)
+            connection.execute(text("DELETE FROM sqlite_sequence WHERE name = :name"), {"name": rebuild})
+            connection.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)"),
+                               {"name": rebuild, "seq": floor})
+
+            connection.execute(text(f"DROP TABLE {preparer.format_table(table)}"))
+            connection.execute(text(f"ALTER TABLE {preparer.quote(rebuild)} RENAME TO {preparer.format_table(table)}"))
+
+# desc: Give every row that shares a value of column with a row of lower primary key a new value from
+#       generate(count), so a unique index can be built on a column that was not unique before
+# return: Number of rows that got a new value
+def reissue_duplicates(connection, table, column, generate) -> int:
+    key = table.primary_key.columns.values()[0]
+    duplicated = select(column).where(column.isnot(None)).group_by(column).having(func.count() > 1)
+    keepers = select(func.min(key)).where(column.in_(duplicated)).group_by(column)
+    keys = [row[0] for row in connection.execute(
+        select(key).where(column.in_(duplicated), key.notin_(keepers)).order_by(key)
+    )]
+    if keys:
+        connection.execute(
+            table.update().where(key == bindparam("row_key")).values({column.name: bindparam("new_value")}),
+            [{"row_key": row_key, "new_value": value} for row_key, value in zip(keys, generate(len(keys)))]
+        )
+        logger.warning(f"Reissued {column.name} of {len(keys)} {table.name} rows that shared it: {keys}")
+    return len(keys)
+
 def init_db():
     Base.metadata.create_all(bind=engine)
+    add_missing_columns()
+    add_missing_autoincrement()
+    # create_all skips tables that already exist, so make sure indexes added later are built too. Before a
+    # unique index is built, duplicates in columns listed in the table's info["reissue_duplicates"] (column
+    # name -> generator of count new values) are given new values
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        generators = table.info.get("reissue_duplicates", {})
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            with engine.begin() as connection:
+                if index.unique:
+                    for column in index.columns:
+                        if column.name in generators:
+                            reissue_duplicates(connection, table, column, generators[column.name])
+                index.create(bind=connection)
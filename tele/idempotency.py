@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from fastapi import HTTPException, Response, status
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import func, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from . import models
+from .cache import LRUCache
+
+# How long a stored response is replayed for the same Idempotency-Key
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+# A pending key whose request has run this long is assumed abandoned (e.g. its worker crashed) and can be
+# taken over by a retry
+IDEMPOTENCY_PENDING_LEASE_SECONDS = float(os.getenv("IDEMPOTENCY_PENDING_LEASE_SECONDS", "300"))
+IDEMPOTENCY_CACHE_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_CACHE_MAX_ENTRIES", "10000"))
+MAX_KEY_LENGTH = 255
+
+# Completed responses by (user_id, key), in front of the idempotency_key table
+response_cache = LRUCache(IDEMPOTENCY_CACHE_MAX_ENTRIES, IDEMPOTENCY_TTL_SECONDS)
+
+# Requests being executed in this process, by (user_id, key); duplicates wait on the event
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+# desc: Fingerprint of what a request asks for, so a key reused for a different request is rejected
+def request_hash(endpoint: str, body=None) -> str:
+    raw = json.dumps([endpoint, jsonable_encoder(body)], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+# desc: Return a stored response if it belongs to the same request, and mark the reply as a replay
+def _replay(entry: tuple, fingerprint: str, response: Response):
+    stored_fingerprint, body = entry
+    if stored_fingerprint != fingerprint:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail="Idempotency-Key was already used for a different request")
+    if response is not None:
+        response.headers["Idempotent-Replayed"] = "true"
+    return body
+
+
+# desc: Claim the key with a pending row in its own transaction. The primary key makes the claim
+#       atomic across processes. A pending row whose lease ran out is taken over by moving its
+#       claimed_at, guarded so only one of several concurrent retries gets it.
+# return: (None, claim time) if the key was claimed, else (the existing row, None)
+def _claim(db: Session, user_id: int, key: str, fingerprint: str):
+    same_key = (models.IdempotencyKey.user_id == user_id, models.IdempotencyKey.key == key)
+    for _ in range(3):
+        now = datetime.now()
+        db.add(models.IdempotencyKey(user_id=user_id, key=key, request_hash=fingerprint, created_at=now, claimed_at=now))
+        try:
+            db.commit()
+            return None, now
+        except IntegrityError:
+            db.rollback()
+        row = db.query(models.IdempotencyKey).filter(*same_key).first()
+        if row is None:
+            continue
+        if row.created_at < now - timedelta(seconds=IDEMPOTENCY_TTL_SECONDS):
+            # The stored response is past its retention; the key can be used again
+            db.delete(row)
+            db.commit()
+            continue
+        if row.response is not None or row.request_hash != fingerprint:
+            return row, None
+
+        claimed_at = func.coalesce(models.IdempotencyKey.claimed_at, models.IdempotencyKey.created_at)
+        taken = db.query(models.IdempotencyKey) \
+                  .filter(*same_key, models.IdempotencyKey.response.is_(None),
+                          claimed_at < now - timedelta(seconds=IDEMPOTENCY_PENDING_LEASE_SECONDS)) \
+                  .update({models.IdempotencyKey.claimed_at: now}, synchronize_session=False)
+        db.commit()
+        if taken:
+            return None, now
+        return row, None
+    raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Idempotency-Key is being claimed concurrently")
+
+
+# desc: Run execute() at most once per (user, Idempotency-Key) within the retention window.
+#       A replay gets the stored response without touching products or orders; a duplicate that
+#       arrives while the first request is still running in this process waits for its result,
+#       and one running in another process gets a 409 until the pending lease runs out. If execute()
+#       fails the key is released so the client can retry.
+# return: The response body of the first successful execution
+def run_once(db: Session, user_id: int, key: str, fingerprint: str, execute, response: Response = None):
+    if key is None:
+        return execute()
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Idempotency-Key is too long")
+
+    cache_key = (user_id, key)
+    while True:
+        entry = response_cache.get(cache_key)
+        if entry is not None:
+            return _replay(entry, fingerprint, response)
+
+        with _in_flight_lock:
+            done = _in_flight.get(cache_key)
+            if done is None:
+                done = _in_flight[cache_key] = threading.Event()
+                break
+        # Collapse onto the execution already running, then read its stored response
+        done.wait()
+
+    try:
+        row, claimed_at = _claim(db, user_id, key, fingerprint)
+        if row is not None:
+            if row.response is None:
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                    detail="A request with this Idempotency-Key is still being processed")
+            entry = (row.request_hash, json.loads(row.response))
+            response_cache.set(cache_key, entry)
+            return _replay(entry, fingerprint, response)
+
+        # Only this claim's row: if the lease ran out and a retry took the key over, it is that retry's
+        claim = (models.IdempotencyKey.user_id == user_id, models.IdempotencyKey.key == key,
+                 models.IdempotencyKey.claimed_at == claimed_at)
+        try:
+            body = jsonable_encoder(execute())
+        except Exception:
+            db.rollback()
+            db.query(models.IdempotencyKey).filter(*claim).delete(synchronize_session=False)
+            db.commit()
+            raise
+
+        db.query(models.IdempotencyKey).filter(*claim) \
+          .update({models.IdempotencyKey.response: json.dumps(body)}, synchronize_session=False)
+        db.commit()
+        response_cache.set(cache_key, (fingerprint, body))
+        return body
+    finally:
+        with _in_flight_lock:
+            del _in_flight[cache_key]
+        done.set()
+
+
+# desc: Delete up to batch_size keys older than the retention window, in the caller's transaction
+# return: Number of keys deleted
+def purge_expired(db: Session, now: datetime, batch_size: int) -> int:
+    cutoff = now - timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)
+    keys = db.query(models.IdempotencyKey.user_id, models.IdempotencyKey.key) \
+             .filter(models.IdempotencyKey.created_at < cutoff) \
+             .order_by(models.IdempotencyKey.created_at).limit(batch_size).all()
+    if keys:
+        db.query(models.IdempotencyKey) \
+          .filter(tuple_(models.IdempotencyKey.user_id, models.IdempotencyKey.key).in_([tuple(key) for key in keys])) \
+          .delete(synchronize_session=False)
+    return len(keys)
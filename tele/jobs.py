@@ -0,0 +1,229 @@
+import json
+import logging
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+from . import database, models
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "1"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_BACKOFF_SECONDS = float(os.getenv("JOB_BACKOFF_SECONDS", "2"))  # Delay before the first retry, doubled after each
+JOB_BACKOFF_MAX_SECONDS = float(os.getenv("JOB_BACKOFF_MAX_SECONDS", "300"))
+
+
+# desc: Persistent in-process job queue. Jobs are rows of the job table, written in the caller's
+#       transaction, so they exist exactly when the change that produced them was committed and they
+#       survive restarts. A dispatcher thread claims due jobs and runs them on a thread pool; a failed
+#       job is retried with exponential backoff until it runs out of attempts.
+class JobQueue:
+    def __init__(self, workers: int, poll_interval: float, max_attempts: int, backoff: float, backoff_max: float):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self._handlers = {}  # handler name -> function(payload, db)
+        self._subscribers = {}  # event -> [handler name]
+        self._slots = threading.Semaphore(workers)
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._executor = None
+        self.succeeded = 0
+        self.retried = 0
+        self.failed = 0
+        self.in_flight = 0
+        # Registered once: a session that published jobs wakes the workers when it commits, and
+        # forgets that it did if it rolls back instead
+        event.listen(Session, "after_commit", self._after_commit)
+        event.listen(Session, "after_rollback", self._after_rollback)
+
+    # desc: Decorator registering a handler for an event; each handler gets its own job and retries
+    def subscribe(self, event_name: str, name: str):
+        def register(handler):
+            self._handlers[name] = handler
+            self._subscribers.setdefault(event_name, []).append(name)
+            return handler
+        return register
+
+    # desc: Queue one job per handler of the event inside the caller's transaction. The workers are
+    #       woken when that transaction commits; a rollback discards the jobs without waking them.
+    # return: Number of jobs queued
+    def publish(self, db: Session, event_name: str, payload: dict) -> int:
+        names = self._subscribers.get(event_name, [])
+        if not names:
+            return 0
+        now = datetime.now()
+        db.execute(models.Job.__table__.insert(), [
+            {"handler": name, "payload": json.dumps(payload), "status": "pending", "attempts": 0,
+             "run_after": now, "created_at": now}
+            for name in names
+        ])
+        db.info[self] = True
+        return len(names)
+
+    def _after_commit(self, session: Session):
+        if session.info.pop(self, False):
+            self._wake.set()
+
+    def _after_rollback(self, session: Session):
+        session.info.pop(self, None)
+
+    # desc: Start the dispatcher; jobs left running by a previous process are queued again
+    def start(self):
+        if self._thread is not None:
+            return
+        db = database.SessionLocal()
+        try:
+            db.query(models.Job).filter(models.Job.status == "running") \
+              .update({models.Job.status: "pending"}, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+        self._stopping.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job-worker")
+        self._thread = threading.Thread(target=self._run, name="job-dispatcher", daemon=True)
+        self._thread.start()
+
+    # desc: Stop claiming jobs and wait for the running ones to finish
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                claimed = self._claim()
+            except Exception as e:
+                logger.error(f"Job dispatch failed: {e}")
+                claimed = 0
+            if not claimed:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    # desc: Claim due jobs for the free worker slots and hand them to the pool
+    # return: Number of jobs claimed
+    def _claim(self) -> int:
+        free = 0
+        while free < self.workers and self._slots.acquire(blocking=False):
+            free += 1
+        if not free:
+            # Every worker is busy; wait until one finishes
+            self._slots.acquire()
+            free = 1
+
+        claimed = []
+        db = database.SessionLocal()
+        try:
+            candidates = db.query(models.Job.job_id, models.Job.handler, models.Job.payload, models.Job.attempts) \
+                           .filter(models.Job.status == "pending", models.Job.run_after <= datetime.now()) \
+                           .order_by(models.Job.run_after).limit(free).all()
+            for job in candidates:
+                # Conditional claim, so a job is never run twice at the same time
+                updated = db.query(models.Job) \
+                            .filter(models.Job.job_id == job.job_id, models.Job.status == "pending") \
+                            .update({models.Job.status: "running"}, synchronize_session=False)
+                if updated:
+                    claimed.append(job)
+            db.commit()
+        finally:
+            db.close()
+            for _ in range(free - len(claimed)):
+                self._slots.release()
+
+        for job in claimed:
+            with self._lock:
+                self.in_flight += 1
+            self._executor.submit(self._execute, job)
+        return len(claimed)
+
+    # desc: Run one job with its own session and record the outcome
+    def _execute(self, job):
+        error = None
+        db = database.SessionLocal()
+        try:
+            self._handlers[job.handler](json.loads(job.payload), db)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            error = e
+        finally:
+            db.close()
+
+        try:
+            self._finish(job, error)
+        except Exception as e:
+            # The job stays running and is queued again on the next start
+            logger.error(f"Could not record the outcome of job {job.job_id}: {e}")
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+    # desc: Delete a finished job, or schedule its retry with exponential backoff and jitter
+    def _finish(self, job, error: Exception = None):
+        db = database.SessionLocal()
+        try:
+            query = db.query(models.Job).filter(models.Job.job_id == job.job_id)
+            if error is None:
+                query.delete(synchronize_session=False)
+                counter = "succeeded"
+            else:
+                attempts = job.attempts + 1
+                values = {models.Job.attempts: attempts, models.Job.last_error: str(error)[:1000]}
+                if attempts >= self.max_attempts:
+                    values[models.Job.status] = "failed"
+                    counter = "failed"
+                    logger.error(f"Job {job.job_id} ({job.handler}) failed for good after {attempts} attempts: {error}")
+                else:
+                    delay = min(self.backoff * 2 ** (attempts - 1), self.backoff_max) * random.uniform(0.8, 1.2)
+                    values[models.Job.status] = "pending"
+                    values[models.Job.run_after] = datetime.now() + timedelta(seconds=delay)
+                    counter = "retried"
+                    logger.warning(f"Job {job.job_id} ({job.handler}) failed, retry in {delay:.1f} s: {error}")
+                query.update(values, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    # desc: Queue depth per status and the worker counters
+    # return: Dictionary of metrics
+    def stats(self) -> dict:
+        db = database.SessionLocal()
+        try:
+            depth = dict(db.query(models.Job.status, func.count(models.Job.job_id)).group_by(models.Job.status).all())
+            oldest = db.query(func.min(models.Job.run_after)).filter(models.Job.status == "pending").scalar()
+        finally:
+            db.close()
+        with self._lock:
+            return {
+                "pending": depth.get("pending", 0),
+                "running": depth.get("running", 0),
+                "failed": depth.get("failed", 0),
+                "oldest_pending_seconds": max((datetime.now() - oldest).total_seconds(), 0) if oldest else 0,
+                "in_flight": self.in_flight,
+                "workers": self.workers,
+                "succeeded": self.succeeded,
+                "retried": self.retried,
+                "failed_for_good": self.failed,
+            }
+
+
+job_queue = JobQueue(JOB_WORKERS, JOB_POLL_INTERVAL_SECONDS, JOB_MAX_ATTEMPTS, JOB_BACKOFF_SECONDS, JOB_BACKOFF_MAX_SECONDS)
@@ -1,12 +1,22 @@
 from fastapi import FastAPI
 from routers import user ,product,order,seller,cart # Adjust the import based on your structure
-from . import database
+from repository.cart_store import get_cart_store
+from repository.sweeper import sweeper
+from repository.order_items import backfill_order_items
+from .jobs import job_queue
+from . import database, search
 
 app = FastAPI()
 
 # Initialize the database
 database.init_db()
 
+# Give orders placed before order_items existed their line (skipped once that has finished)
+backfill_order_items()
+
+# Build (or reuse) the full-text product index
+search.init_search_index(database.engine)
+
 # Include user router
 app.include_router(user.router)
 
@@ -17,3 +27,39 @@ app.include_router(product.router)
 app.include_router(order.router)
 
 app.include_router(cart.router)
+
+
+# Start the cart store's background writer, if it has one
+@app.on_event("startup")
+def start_cart_store():
+    get_cart_store().start()
+
+
+# Run queued background jobs, including the ones left over from the previous run
+@app.on_event("startup")
+def start_job_queue():
+    job_queue.start()
+
+
+# Let running jobs finish; pending ones stay in the job table for the next start
+@app.on_event("shutdown")
+def stop_job_queue():
+    job_queue.stop()
+
+
+# Expire abandoned cart lines in the background (disabled with SWEEP_INTERVAL_SECONDS=0)
+@app.on_event("startup")
+def start_sweeper():
+    sweeper.start()
+
+
+# Stop the sweeper before the cart store so its last changes are written too
+@app.on_event("shutdown")
+def stop_sweeper():
+    sweeper.stop()
+
+
+# Write pending cart changes before the process exits
+@app.on_event("shutdown")
+def stop_cart_store():
+    get_cart_store().stop()
@@ -1,7 +1,8 @@
-from sqlalchemy import Column, Integer, String,Float,Boolean,ForeignKey,DateTime
+from sqlalchemy import Column, Integer, String,Float,Boolean,ForeignKey,DateTime,Date,Text,Index,literal_column
 from .database import Base  # Adjusted for relative import
 from sqlalchemy.orm import relationship
 from datetime import datetime
+from .tracking import generate_tracking_numbers
 class User(Base):
     __tablename__ = 'user'
     
@@ -59,11 +60,28 @@ class Product(Base):
     tax = Column(Float, default=0.0)  # Tax percentage applied
     product_video = Column(String)  # Link to a product video if available
     tags = Column(String)  # Keywords for search optimization
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now, index=True)  # Last change, watermark for exports
+    version = Column(Integer, nullable=False, default=1, server_default="1", onupdate=literal_column("version + 1"))  # Bumped by every UPDATE, used for ETags
+    reserved_stock = Column(Integer, nullable=False, default=0, server_default="0")  # Units held by live cart reservations
 
     # Relationships
     seller = relationship("User", back_populates="products")  # Reference to the User table
     orders = relationship("Order", back_populates="product")  # Relationship with orders
     cart_items = relationship("Cart", back_populates="product")
+
+    __table_args__ = (
+        # Keyset pagination indexes: each sort key is paired with product_id as the tie-breaker
+        Index("ix_product_price_id", "price", "product_id"),
+        Index("ix_product_rating_id", "rating", "product_id"),
+        Index("ix_product_launch_date_id", "launch_date", "product_id"),
+        # Storefront filter indexes for /products/search and its brand/subcategory facet counts
+        Index("ix_product_category_subcategory_brand", "category", "subcategory", "brand"),
+        Index("ix_product_category_price", "category", "price"),
+        Index("ix_product_brand_category", "brand", "category"),
+        Index("ix_product_status_featured", "product_status", "featured"),
+        # Seller order history joins orders to the seller's products
+        Index("ix_product_seller_id", "seller_id"),
+    )
 class Order(Base):
     __tablename__ = 'orders'
 
@@ -83,6 +101,91 @@ class Order(Base):
     # Relationships
     user = relationship("User", back_populates="orders")  # Reference to User table
     product = relationship("Product", back_populates="orders")
+    # Lines of the order; loaded with one extra query per batch of orders
+    items = relationship("OrderItem", back_populates="order", cascade="all, delete-orphan", lazy="selectin",
+                         order_by="OrderItem.item_id")
+
+    __table_args__ = (
+        # Order history is read per user, newest first
+        Index("ix_orders_user_order_date", "user_id", "order_date"),
+        Index("ix_orders_product_id", "product_id"),
+        # Archival picks old orders by date
+        Index("ix_orders_order_date", "order_date"),
+        # Parcel tracking looks orders up by tracking number, which must never be shared
+        Index("ix_orders_tracking_number", "tracking_number", unique=True),
+        # IDs are never handed out twice, even once the highest one was archived or deleted; archived
+        # orders keep their ID, so the sequence also starts above the archive's
+        # Orders could share a tracking number before it was unique; later ones get new numbers on upgrade
+        {"sqlite_autoincrement": True, "info": {"sequence_shared_with": ("orders_archive",),
+                                                "reissue_duplicates": {"tracking_number": generate_tracking_numbers}}},
+    )
+
+
+class OrderArchive(Base):
+    __tablename__ = 'orders_archive'
+
+    # Delivered or cancelled orders moved out of orders once they are old; same columns plus archived_at
+    order_id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer)
+    product_id = Column(Integer)
+    quantity = Column(Integer, nullable=False)
+    total_price = Column(Float, nullable=False)
+    order_status = Column(String)
+    order_date = Column(DateTime)
+    delivery_address = Column(String, nullable=False)
+    payment_method = Column(String, nullable=False)
+    payment_status = Column(String)
+    tracking_number = Column(String, nullable=True)
+    estimated_delivery_date = Column(DateTime, nullable=True)
+    archived_at = Column(DateTime, default=datetime.now)
+
+    items = relationship("OrderItemArchive", lazy="selectin", viewonly=True, order_by="OrderItemArchive.item_id",
+                         primaryjoin="OrderArchive.order_id == foreign(OrderItemArchive.order_id)")
+
+    __table_args__ = (
+        Index("ix_orders_archive_user_order_date", "user_id", "order_date"),
+        Index("ix_orders_archive_product_id", "product_id"),
+        Index("ix_orders_archive_tracking_number", "tracking_number", unique=True),
+        {"info": {"reissue_duplicates": {"tracking_number": generate_tracking_numbers}}},
+    )
+
+
+class OrderItem(Base):
+    __tablename__ = 'order_items'
+
+    # One product line of an order; status, payment and delivery details live on the order
+    item_id = Column(Integer, primary_key=True, index=True)
+    order_id = Column(Integer, ForeignKey('orders.order_id'), nullable=False)
+    product_id = Column(Integer, ForeignKey('product.product_id'), nullable=False)
+    quantity = Column(Integer, nullable=False)
+    unit_price = Column(Float, nullable=False)
+    total_price = Column(Float, nullable=False)
+
+    order = relationship("Order", back_populates="items")
+
+    __table_args__ = (
+        Index("ix_order_items_order_id", "order_id"),
+        # Seller history and the sales rollup find lines by product
+        Index("ix_order_items_product_id", "product_id"),
+        {"sqlite_autoincrement": True},
+    )
+
+
+class OrderItemArchive(Base):
+    __tablename__ = 'order_items_archive'
+
+    # Lines of archived orders, moved together with their order
+    item_id = Column(Integer, primary_key=True, index=True)
+    order_id = Column(Integer, nullable=False)
+    product_id = Column(Integer, nullable=False)
+    quantity = Column(Integer, nullable=False)
+    unit_price = Column(Float, nullable=False)
+    total_price = Column(Float, nullable=False)
+
+    __table_args__ = (
+        Index("ix_order_items_archive_order_id", "order_id"),
+        Index("ix_order_items_archive_product_id", "product_id"),
+    )
 
 
 class Cart(Base):
@@ -98,4 +201,88 @@ class Cart(Base):
 
     user = relationship("User", back_populates="cart_items")
     product = relationship("Product", back_populates="cart_items")
- 
\ No newline at end of file
+
+    __table_args__ = (
+        # Cart lookups filter on user_id and often product_id; the sweeper scans by added_date
+        Index("ix_cart_user_product", "user_id", "product_id"),
+        Index("ix_cart_added_date", "added_date"),
+    )
+
+
+class Reservation(Base):
+    __tablename__ = "reservation"
+
+    # Stock held for a user's cart line until expires_at; product.reserved_stock is the sum per product
+    reservation_id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("user.user_id"), nullable=False)
+    product_id = Column(Integer, ForeignKey("product.product_id"), nullable=False)
+    quantity = Column(Integer, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_reservation_user_product", "user_id", "product_id", unique=True),
+        Index("ix_reservation_expires_at", "expires_at"),
+    )
+
+
+class SellerDailySales(Base):
+    __tablename__ = "seller_daily_sales"
+
+    # Sales of one product on one day, kept up to date as orders are placed and change status
+    seller_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    product_id = Column(Integer, primary_key=True)
+    order_count = Column(Integer, nullable=False, default=0)  # Orders that are not cancelled
+    units = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0.0)
+    paid_revenue = Column(Float, nullable=False, default=0.0)  # Part of revenue whose payment_status is paid
+
+
+class Job(Base):
+    __tablename__ = "job"
+
+    # Background work queued by tele.jobs; a row is deleted once its handler succeeds
+    job_id = Column(Integer, primary_key=True, index=True)
+    handler = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)  # JSON
+    status = Column(String, nullable=False, default="pending")  # pending, running or failed
+    attempts = Column(Integer, nullable=False, default=0)
+    run_after = Column(DateTime, nullable=False, default=datetime.now)  # Not picked up before this time (backoff)
+    last_error = Column(String)
+    created_at = Column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        Index("ix_job_status_run_after", "status", "run_after"),
+    )
+
+
+class SchemaMigration(Base):
+    __tablename__ = "schema_migration"
+
+    # One-time data migrations that have finished, so startup can skip them
+    name = Column(String, primary_key=True)
+    finished_at = Column(DateTime, nullable=False, default=datetime.now)
+
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_key"
+
+    # Response of a request sent with an Idempotency-Key; response is NULL while the request is running
+    user_id = Column(Integer, primary_key=True)
+    key = Column(String, primary_key=True)
+    request_hash = Column(String, nullable=False)
+    response = Column(Text)  # JSON
+    created_at = Column(DateTime, nullable=False, default=datetime.now, index=True)
+    claimed_at = Column(DateTime)  # When the running request took the key; NULL on rows older than the column
+
+
+class CartSummary(Base):
+    __tablename__ = "cart_summary"
+
+    # Running totals of a user's cart, kept up to date by every cart change
+    user_id = Column(Integer, ForeignKey("user.user_id"), primary_key=True)
+    line_count = Column(Integer, nullable=False, default=0)
+    item_count = Column(Integer, nullable=False, default=0)  # Sum of the line quantities
+    total_price = Column(Float, nullable=False, default=0.0)
+    updated_at = Column(DateTime, default=datetime.now)
+    stale = Column(Boolean, nullable=False, default=False, server_default="0")  # Set when a price in the cart changed
@@ -0,0 +1,29 @@
+import base64
+import json
+from fastapi import HTTPException, status
+
+# Page size limits shared by every keyset-paginated route
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+# desc: Encode the position of the last row of a page into an opaque, URL-safe cursor
+# return: Cursor string to hand back to the client as next_cursor
+def encode_cursor(*values) -> str:
+    raw = json.dumps(list(values), default=str, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+# desc: Decode a cursor produced by encode_cursor and check it has the expected number of values
+# return: List of the values that were encoded
+def decode_cursor(cursor: str, size: int) -> list:
+    invalid_cursor = HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except ValueError:
+        raise invalid_cursor
+
+    if not isinstance(values, list) or len(values) != size:
+        raise invalid_cursor
+    return values
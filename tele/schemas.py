@@ -1,7 +1,7 @@
 from typing import Optional
 from pydantic import BaseModel, EmailStr, Field, validator
 from datetime import date,datetime
-from typing import List
+from typing import Dict, List, Literal
 
 class Create_User(BaseModel):
     user_id: int
@@ -88,6 +88,106 @@ class Create_Product(BaseModel):
     class Config:
         from_attributes = True
 
+# Single product response, with the validators behind its ETag and Last-Modified headers
+class ProductDetail(Create_Product):
+    version: int = 1
+    updated_at: Optional[datetime] = None
+
+# Partial product update: only the fields present in the request body are written
+class ProductPatch(BaseModel):
+    product_name: Optional[str] = None
+    description: Optional[str] = None
+    category: Optional[str] = None
+    subcategory: Optional[str] = None
+    brand: Optional[str] = None
+    price: Optional[float] = None
+    discount: Optional[float] = None
+    stock: Optional[int] = None
+    sku: Optional[str] = None
+    image_url: Optional[str] = None
+    rating: Optional[float] = None
+    reviews_count: Optional[int] = None
+    launch_date: Optional[date] = None
+    color: Optional[str] = None
+    size: Optional[str] = None
+    dimensions: Optional[str] = None
+    weight: Optional[float] = None
+    shipping_info: Optional[str] = None
+    return_policy: Optional[str] = None
+    warranty: Optional[str] = None
+    product_status: Optional[str] = None
+    featured: Optional[bool] = None
+    tax: Optional[float] = None
+    product_video: Optional[str] = None
+    tags: Optional[str] = None
+
+class ProductBatchRequest(BaseModel):
+    ids: List[int]
+
+class ProductBatchResponse(BaseModel):
+    items: List[ProductDetail]  # In the order the IDs were requested, duplicates removed
+    missing: List[int]
+
+# Compact projection for listing pages, returned with ?fields=summary
+class ProductSummary(BaseModel):
+    product_id: int
+    product_name: Optional[str] = None
+    brand: Optional[str] = None
+    price: Optional[float] = None
+    discounted_price: Optional[float] = None
+    image_url: Optional[str] = None
+    rating: Optional[float] = None
+
+    class Config:
+        from_attributes = True
+
+# Every product field, all optional: list routes return only the fields asked for with ?fields=
+class ProductFields(ProductSummary):
+    description: Optional[str] = None
+    category: Optional[str] = None
+    subcategory: Optional[str] = None
+    discount: Optional[float] = None
+    stock: Optional[int] = None
+    sku: Optional[str] = None
+    reviews_count: Optional[int] = None
+    launch_date: Optional[date] = None
+    color: Optional[str] = None
+    size: Optional[str] = None
+    dimensions: Optional[str] = None
+    weight: Optional[float] = None
+    seller_id: Optional[int] = None
+    shipping_info: Optional[str] = None
+    return_policy: Optional[str] = None
+    warranty: Optional[str] = None
+    product_status: Optional[str] = None
+    featured: Optional[bool] = None
+    tax: Optional[float] = None
+    product_video: Optional[str] = None
+    tags: Optional[str] = None
+    updated_at: Optional[datetime] = None
+    version: Optional[int] = None
+
+class ProductPage(BaseModel):
+    items: List[ProductFields]
+    next_cursor: Optional[str] = None  # Pass back as ?cursor= to fetch the next page
+
+class ImportRowError(BaseModel):
+    row: int  # 1-based data row (CSV) or line (NDJSON) number
+    error: str
+
+class ProductImportReport(BaseModel):
+    inserted: int
+    failed: int
+    errors: List[ImportRowError]
+    errors_truncated: bool = False
+
+class ProductFacets(BaseModel):
+    brands: Dict[str, int]
+    subcategories: Dict[str, int]
+
+class ProductSearchPage(ProductPage):
+    facets: ProductFacets
+
 
 
 class OrderBase(BaseModel):
@@ -106,8 +206,18 @@ class OrderUpdate(BaseModel):
     tracking_number: Optional[str] = None
     estimated_delivery_date: Optional[datetime] = None
 
+class OrderItemResponse(BaseModel):
+    product_id: int
+    quantity: int
+    unit_price: float
+    total_price: float
+
+    class Config:
+        from_attributes = True
+
 class OrderResponse(BaseModel):
     order_id: int
+    # For a multi-line order: the first line's product, the total units and the order total
     product_id: int
     quantity: int
     total_price: float
@@ -118,6 +228,7 @@ class OrderResponse(BaseModel):
     payment_status: str
     tracking_number: str = None
     estimated_delivery_date: datetime = None
+    items: List[OrderItemResponse] = []
 
     class Config:
         from_attributes = True
@@ -135,6 +246,53 @@ class OrderResponse(BaseModel):
         if value and isinstance(value, datetime):
             return value.strftime("%Y-%m-%d %H:%M:%S")
         return value
+
+class OrderBulkItem(OrderUpdate):
+    order_id: int
+
+class OrderBulkFilter(BaseModel):
+    order_status: Optional[str] = None
+    payment_status: Optional[str] = None
+    date_from: Optional[datetime] = None
+    date_to: Optional[datetime] = None
+
+class OrderBulkUpdate(BaseModel):
+    # Either a list of per-order updates, or a filter and the patch to apply to every order it matches
+    updates: Optional[List[OrderBulkItem]] = None
+    filter: Optional[OrderBulkFilter] = None
+    patch: Optional[OrderUpdate] = None
+
+class OrderBulkOutcome(BaseModel):
+    order_id: int
+    status: Literal["updated", "not_found", "failed"]
+    detail: Optional[str] = None
+
+class OrderBulkResult(BaseModel):
+    updated: int
+    not_found: int
+    failed: int
+    outcomes: List[OrderBulkOutcome]
+
+class OrderPage(BaseModel):
+    items: List[OrderResponse]
+    next_cursor: Optional[str] = None  # Pass back as ?cursor= to fetch the next page
+
+class SalesTotals(BaseModel):
+    order_count: int
+    units: int
+    revenue: float
+    paid_revenue: float
+
+class DailySales(SalesTotals):
+    day: date
+    product_id: int
+
+    class Config:
+        from_attributes = True
+
+class SellerSales(BaseModel):
+    items: List[DailySales]
+    totals: SalesTotals
     
 
 class CartItem(BaseModel):
@@ -150,7 +308,22 @@ class CartResponse(BaseModel):
 
 class CartCreate(BaseModel):
     product_id: int
-    quantity: int
+    quantity: int = Field(gt=0)
+
+class CartOperation(BaseModel):
+    op: Literal["add", "update", "remove"]
+    product_id: Optional[int] = None  # Required for add
+    cart_id: Optional[int] = None  # Required for update and remove
+    quantity: Optional[int] = Field(default=None, gt=0)  # Required for add and update
+
+class CartBatchRequest(BaseModel):
+    operations: List[CartOperation]
+
+class CartSummary(BaseModel):
+    line_count: int
+    item_count: int
+    total_price: float
+    updated_at: Optional[datetime] = None
 
 class Cart(BaseModel):
     cart_id: int
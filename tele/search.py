@@ -0,0 +1,85 @@
+import logging
+import re
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Product columns covered by the full-text index
+SEARCH_COLUMNS = ("product_name", "brand", "tags", "category", "description")
+
+# BM25 weight of each column above, in the same order: a hit in the name counts the most
+SEARCH_WEIGHTS = (10.0, 5.0, 3.0, 2.0, 1.0)
+
+# Set by init_search_index once the FTS5 table and its triggers exist
+fts_enabled = False
+
+
+# desc: Build the DDL for the product_fts table and the triggers that keep it in sync with product
+# return: List of SQL statements
+def _search_index_ddl() -> list:
+    columns = ", ".join(SEARCH_COLUMNS)
+    new_values = ", ".join(f"new.{column}" for column in SEARCH_COLUMNS)
+    old_values = ", ".join(f"old.{column}" for column in SEARCH_COLUMNS)
+    insert_new = f"INSERT INTO product_fts(rowid, {columns}) VALUES (new.product_id, {new_values});"
+    delete_old = f"INSERT INTO product_fts(product_fts, rowid, {columns}) VALUES ('delete', old.product_id, {old_values});"
+
+    return [
+        f"CREATE VIRTUAL TABLE product_fts USING fts5({columns}, content='product', content_rowid='product_id', "
+        "tokenize='unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER product_fts_ai AFTER INSERT ON product BEGIN {insert_new} END",
+        f"CREATE TRIGGER product_fts_ad AFTER DELETE ON product BEGIN {delete_old} END",
+        # Only edits to indexed columns touch the index, so stock and price updates stay cheap
+        f"CREATE TRIGGER product_fts_au AFTER UPDATE OF {columns} ON product BEGIN {delete_old} {insert_new} END",
+        "INSERT INTO product_fts(product_fts) VALUES ('rebuild')",
+    ]
+
+
+# desc: Create the FTS5 product index on SQLite and backfill it from the existing rows
+# return: True if full-text search is available, False if callers should fall back to ILIKE
+def init_search_index(engine) -> bool:
+    global fts_enabled
+    if engine.dialect.name != "sqlite":
+        return False
+
+    try:
+        with engine.begin() as connection:
+            exists = connection.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'product_fts'")
+            ).first()
+            if not exists:
+                for statement in _search_index_ddl():
+                    connection.execute(text(statement))
+    except OperationalError as e:
+        logger.warning(f"Full-text search unavailable, falling back to ILIKE: {e}")
+        return False
+
+    fts_enabled = True
+    return True
+
+
+# desc: Turn free text from the user into an FTS5 query (every word must match, as a prefix)
+# return: MATCH expression, or an empty string if the text has no searchable words
+def build_match_query(search_text: str) -> str:
+    words = re.findall(r"\w+", search_text)
+    return " ".join(f'"{word}"*' for word in words)
+
+
+# desc: Run a ranked full-text search over the product index
+# return: Product IDs of one page of hits, best match first
+def search_product_ids(db: Session, search_text: str, limit: int, offset: int = 0) -> list:
+    match_query = build_match_query(search_text)
+    if not match_query:
+        return []
+
+    weights = ", ".join(str(weight) for weight in SEARCH_WEIGHTS)
+    rows = db.execute(
+        text(
+            "SELECT rowid FROM product_fts WHERE product_fts MATCH :query "
+            f"ORDER BY bm25(product_fts, {weights}) LIMIT :limit OFFSET :offset"
+        ),
+        {"query": match_query, "limit": limit, "offset": offset},
+    )
+    return [row[0] for row in rows]
@@ -0,0 +1,53 @@
+import secrets
+import string
+import threading
+import time
+
+# Digits before letters, i.e. ASCII order, so tracking numbers sort by the time they were generated
+ALPHABET = string.digits + string.ascii_uppercase
+SEQUENCE_PER_MS = len(ALPHABET) ** 2  # Numbers one process can generate per millisecond before borrowing ahead
+TIME_WIDTH = 11  # Milliseconds since the epoch times SEQUENCE_PER_MS, in base 36
+RANDOM_WIDTH = 6  # Random characters that keep numbers from different processes apart
+
+# Last time-ordered value handed out by this process
+_last = 0
+_lock = threading.Lock()
+
+
+# desc: Write a non-negative integer as exactly width base-36 characters
+def _encode(value: int, width: int) -> str:
+    chars = []
+    for _ in range(width):
+        value, digit = divmod(value, len(ALPHABET))
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+
+# desc: Reserve count consecutive time-ordered values. They only ever increase within the process,
+#       even if the clock goes backwards or more than SEQUENCE_PER_MS numbers are needed in one millisecond.
+# return: The first reserved value
+def _reserve(count: int) -> int:
+    global _last
+    with _lock:
+        first = max(time.time_ns() // 1_000_000 * SEQUENCE_PER_MS, _last + 1)
+        _last = first + count - 1
+    return first
+
+
+# desc: Generate count tracking numbers at once (e.g. one per line of a checkout): a time-ordered part
+#       that never repeats within the process, followed by random characters from one draw for the batch
+# return: List of 17-character tracking numbers
+def generate_tracking_numbers(count: int) -> list:
+    if count <= 0:
+        return []
+    first = _reserve(count)
+    random_part = _encode(secrets.randbelow(len(ALPHABET) ** (RANDOM_WIDTH * count)), RANDOM_WIDTH * count)
+    return [
+        _encode(first + i, TIME_WIDTH) + random_part[i * RANDOM_WIDTH:(i + 1) * RANDOM_WIDTH]
+        for i in range(count)
+    ]
+
+
+# desc: Generate a single tracking number
+def generate_tracking_number() -> str:
+    return generate_tracking_numbers(1)[0]
@@ -0,0 +1,54 @@
+import os
+import tempfile
+
+# The engine is created when tele.database is imported, so point it at a scratch database first
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}"
+
+import pytest  # noqa: E402
+from tele import database, models  # noqa: E402
+from repository import cart_store  # noqa: E402
+
+
+# desc: A session on freshly created tables
+@pytest.fixture
+def db():
+    database.Base.metadata.drop_all(bind=database.engine)
+    database.init_db()
+    session = database.SessionLocal()
+    yield session
+    session.close()
+
+
+# desc: Each cart store in turn, installed as the one get_cart_store returns
+@pytest.fixture(params=["sql", "memory"])
+def store(request, monkeypatch):
+    if request.param == "memory":
+        selected = cart_store.MemoryCartStore(flush_interval=60, flush_batch_size=200, idle_seconds=1800)
+    else:
+        selected = cart_store.SqlCartStore()
+    monkeypatch.setattr(cart_store, "_store", selected)
+    return selected
+
+
+# desc: Factory for users
+@pytest.fixture
+def make_user(db):
+    def make(name: str = "user") -> models.User:
+        user = models.User(user_name=name, phone_number="9999999999", address="1 Test Street",
+                           email_id=f"{name}-{db.query(models.User).count()}@example.com")
+        db.add(user)
+        db.commit()
+        return user
+    return make
+
+
+# desc: Factory for products
+@pytest.fixture
+def make_product(db):
+    def make(stock: int = 100, price: float = 10.0, seller_id: int = None) -> models.Product:
+        product = models.Product(product_name=f"product-{db.query(models.Product).count()}", category="test",
+                                 price=price, discounted_price=price, stock=stock, sku="SKU", seller_id=seller_id)
+        db.add(product)
+        db.commit()
+        return product
+    return make
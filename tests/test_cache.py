@@ -0,0 +1,30 @@
+from tele.cache import LRUCache
+
+
+def test_load_started_before_a_write_does_not_overwrite_it():
+    cache = LRUCache(max_entries=10, ttl_seconds=60)
+
+    def load_stale():
+        # A writer stores the new value while this load is still reading the old row
+        cache.set("key", "fresh")
+        return "stale"
+
+    assert cache.get_or_load("key", load_stale) == "stale"
+    assert cache.get("key") == "fresh"
+
+
+def test_batch_load_started_before_a_write_does_not_overwrite_it():
+    cache = LRUCache(max_entries=10, ttl_seconds=60)
+
+    def load_stale(keys):
+        cache.set("a", "fresh")
+        return {key: "stale" for key in keys}
+
+    cache.get_many_or_load(["a", "b"], load_stale)
+    assert cache.get("a") == "fresh"
+
+
+def test_load_without_concurrent_write_is_cached():
+    cache = LRUCache(max_entries=10, ttl_seconds=60)
+    assert cache.get_or_load("key", lambda: "value") == "value"
+    assert cache.get("key") == "value"
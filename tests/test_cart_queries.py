@@ -0,0 +1,52 @@
+from contextlib import contextmanager
+from sqlalchemy import event
+from tele import database
+from repository import cart
+
+
+# desc: Count the statements sent to the database inside the block
+@contextmanager
+def count_queries():
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(database.engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(database.engine, "before_cursor_execute", record)
+
+
+# desc: Queries of a cold and a warm read of the cart and of its total, for a cart of the given size
+def _cart_read_queries(store, db, make_user, make_product, lines: int) -> list:
+    user = make_user()
+    for _ in range(lines):
+        product = make_product()
+        store.add(user.user_id, product.product_id, 2, db, price=product.discounted_price)
+    db.expire_all()
+
+    counts = []
+    for read in (cart.get_cart_items, cart.calculate_cart_total, cart.get_cart_items, cart.calculate_cart_total):
+        with count_queries() as statements:
+            read(user.user_id, db)
+        counts.append(len(statements))
+    return counts
+
+
+def test_cart_reads_do_not_scale_with_cart_size(store, db, make_user, make_product):
+    small = _cart_read_queries(store, db, make_user, make_product, 1)
+    large = _cart_read_queries(store, db, make_user, make_product, 40)
+    assert small == large
+
+
+def test_cart_total_matches_lines(store, db, make_user, make_product):
+    user = make_user()
+    for price in (5.0, 7.5, 12.25):
+        product = make_product(price=price)
+        store.add(user.user_id, product.product_id, 2, db, price=price)
+
+    items = cart.get_cart_items(user.user_id, db)
+    assert len(items["items"]) == 3
+    assert items["total_price"] == cart.calculate_cart_total(user.user_id, db)["total_price"] == 49.5
@@ -0,0 +1,46 @@
+import pytest
+from pydantic import ValidationError
+from tele import models, schemas
+from repository import cart, cart_store, reservation
+
+
+def _reserved(db, product_id: int) -> int:
+    db.expire_all()
+    return db.query(models.Product.reserved_stock).filter(models.Product.product_id == product_id).scalar()
+
+
+def test_non_positive_quantities_are_rejected(db, make_user, make_product):
+    with pytest.raises(ValidationError):
+        schemas.CartCreate(product_id=1, quantity=0)
+    with pytest.raises(ValidationError):
+        schemas.CartOperation(op="add", product_id=1, quantity=-3)
+
+    user, product = make_user(), make_product(stock=5)
+    with pytest.raises(ValueError):
+        reservation.reserve(db, user.user_id, product.product_id, -3)
+    assert _reserved(db, product.product_id) == 0
+
+
+# desc: A SQL store whose writes fail after the reservation was made in the same session
+class FailingSqlCartStore(cart_store.SqlCartStore):
+    def add(self, *args, **kwargs):
+        raise RuntimeError("cart write failed")
+
+    def replace(self, *args, **kwargs):
+        raise RuntimeError("cart write failed")
+
+
+def test_sql_store_commits_reservation_and_line_together(db, make_user, make_product, monkeypatch):
+    monkeypatch.setattr(cart_store, "_store", FailingSqlCartStore())
+    user = make_user()
+    product = make_product(stock=5, seller_id=make_user("seller").user_id)
+
+    with pytest.raises(RuntimeError):
+        cart.add_to_cart(schemas.CartCreate(product_id=product.product_id, quantity=2), user.user_id, db)
+    with pytest.raises(RuntimeError):
+        cart.apply_cart_batch(schemas.CartBatchRequest(operations=[
+            schemas.CartOperation(op="add", product_id=product.product_id, quantity=3)
+        ]), user.user_id, db)
+
+    assert _reserved(db, product.product_id) == 0
+    assert db.query(models.Reservation).count() == 0
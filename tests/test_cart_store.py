@@ -0,0 +1,42 @@
+from tele import database, models
+from repository import product
+
+
+def test_checkout_keeps_lines_changed_while_it_ran(store, db, make_user, make_product):
+    user = make_user()
+    kept, added = make_product(), make_product()
+    store.add(user.user_id, kept.product_id, 1, db, price=kept.discounted_price)
+
+    other = database.SessionLocal()
+    try:
+        with store.checkout(user.user_id, db) as lines:
+            # Another request of the same user, between reading the cart and placing the order
+            store.add(user.user_id, kept.product_id, 2, other, price=kept.discounted_price)
+            store.add(user.user_id, added.product_id, 1, other, price=added.discounted_price)
+            store.remove_ordered(user.user_id, lines, db)
+            db.commit()
+    finally:
+        other.close()
+
+    quantities = {line.product_id: line.quantity for line in store.get_lines(user.user_id, db)}
+    assert quantities == {kept.product_id: 2, added.product_id: 1}
+    assert store.get_summary(user.user_id, db)["item_count"] == 3
+    if hasattr(store, "flush"):
+        store.flush()
+    db.expire_all()
+    rows = db.query(models.Cart.product_id, models.Cart.quantity).filter(models.Cart.user_id == user.user_id).all()
+    assert dict(rows) == quantities
+
+
+def test_deleting_a_product_updates_the_summaries_of_carts_holding_it(store, db, make_user, make_product):
+    seller, buyer = make_user("seller"), make_user("buyer")
+    deleted, kept = make_product(price=25.0, seller_id=seller.user_id), make_product(price=10.0)
+    store.add(buyer.user_id, deleted.product_id, 2, db, price=deleted.discounted_price)
+    store.add(buyer.user_id, kept.product_id, 1, db, price=kept.discounted_price)
+    assert store.get_summary(buyer.user_id, db)["total_price"] == 60.0
+
+    product.delete_product(deleted.product_id, db, models.seller(seller_id=seller.user_id))
+
+    summary = store.get_summary(buyer.user_id, db)
+    assert summary["total_price"] == 10.0
+    assert summary["item_count"] == 1
@@ -0,0 +1,56 @@
+import threading
+from fastapi import HTTPException
+from tele import database, models
+from repository import cart
+
+CHECKOUTS = 20
+STOCK = 5
+
+
+# desc: Run one checkout per user at the same time, each with its own session
+# return: Number of checkouts that placed an order
+def _checkout_all(user_ids: list) -> int:
+    start = threading.Barrier(len(user_ids))
+    placed = []
+    errors = []
+
+    def checkout(user_id: int):
+        db = database.SessionLocal()
+        try:
+            start.wait()
+            cart.order_cart(user_id, db)
+            placed.append(user_id)
+        except HTTPException as e:
+            if e.status_code != 400:
+                errors.append(e)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=checkout, args=(user_id,)) for user_id in user_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    return len(placed)
+
+
+def test_parallel_checkouts_never_oversell(store, db, make_user, make_product):
+    product = make_product(stock=STOCK)
+    user_ids = []
+    for i in range(CHECKOUTS):
+        user = make_user(f"buyer{i}")
+        # Straight into the store, without a reservation, so every checkout competes for the stock
+        store.add(user.user_id, product.product_id, 1, db, price=product.discounted_price)
+        user_ids.append(user.user_id)
+
+    placed = _checkout_all(user_ids)
+
+    db.expire_all()
+    stock = db.query(models.Product.stock).filter(models.Product.product_id == product.product_id).scalar()
+    assert stock >= 0
+    assert placed == STOCK
+    assert stock == STOCK - placed
+    assert db.query(models.OrderItem).filter(models.OrderItem.product_id == product.product_id).count() == placed
@@ -0,0 +1,27 @@
+from datetime import datetime, timedelta
+import pytest
+from fastapi import HTTPException
+from tele import idempotency, models
+
+
+def _pending(db, user_id: int, key: str, fingerprint: str, claimed_seconds_ago: float):
+    claimed_at = datetime.now() - timedelta(seconds=claimed_seconds_ago)
+    db.add(models.IdempotencyKey(user_id=user_id, key=key, request_hash=fingerprint,
+                                 created_at=claimed_at, claimed_at=claimed_at))
+    db.commit()
+
+
+def test_pending_key_is_taken_over_once_its_lease_runs_out(db, make_user):
+    user = make_user()
+    fingerprint = idempotency.request_hash("/orders/create", {"product_id": 1})
+    _pending(db, user.user_id, "running", fingerprint, 5)
+    _pending(db, user.user_id, "abandoned", fingerprint, idempotency.IDEMPOTENCY_PENDING_LEASE_SECONDS + 5)
+
+    with pytest.raises(HTTPException) as conflict:
+        idempotency.run_once(db, user.user_id, "running", fingerprint, lambda: {"order_id": 1})
+    assert conflict.value.status_code == 409
+
+    assert idempotency.run_once(db, user.user_id, "abandoned", fingerprint, lambda: {"order_id": 2}) == {"order_id": 2}
+    # The retry that took the key over stored its response for later replays
+    idempotency.response_cache.clear()
+    assert idempotency.run_once(db, user.user_id, "abandoned", fingerprint, lambda: {"order_id": 3}) == {"order_id": 2}
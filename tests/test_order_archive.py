@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateTable
+from tele import database, models
+from repository import order, order_archive
+
+OLD = datetime.now() - timedelta(days=400)
+
+
+# desc: Insert an order with one line and return its ID
+def _add_order(db, user, product, order_status: str = "Pending", order_date: datetime = None) -> int:
+    placed = models.Order(user_id=user.user_id, product_id=product.product_id, quantity=1, total_price=product.price,
+                          delivery_address=user.address, payment_method="Card", order_status=order_status,
+                          order_date=order_date or datetime.now(),
+                          items=[models.OrderItem(product_id=product.product_id, quantity=1,
+                                                  unit_price=product.price, total_price=product.price)])
+    db.add(placed)
+    db.commit()
+    return placed.order_id
+
+
+def test_archived_order_ids_are_not_reused(db, make_user, make_product):
+    user = make_user()
+    product = make_product()
+    archived_id = _add_order(db, user, product, "Delivered", OLD)
+    newest_id = _add_order(db, user, product)
+
+    assert order_archive.archive_orders(db, datetime.now() - timedelta(days=180), 100) == 1
+    db.commit()
+    # Deleting the newest live order used to let SQLite hand out the lowest free IDs again
+    db.query(models.OrderItem).filter(models.OrderItem.order_id == newest_id).delete()
+    db.query(models.Order).filter(models.Order.order_id == newest_id).delete()
+    db.commit()
+
+    new_id = _add_order(db, user, product)
+    assert new_id > newest_id
+    assert order.get_order_by_id(archived_id, db, include_archived=True).order_status == "Delivered"
+    assert order.get_order_by_id(new_id, db, include_archived=True).order_status == "Pending"
+
+
+def test_archive_skips_an_id_already_in_the_archive(db, make_user, make_product):
+    user = make_user()
+    product = make_product()
+    clash_id = _add_order(db, user, product, "Delivered", OLD)
+    other_id = _add_order(db, user, product, "Delivered", OLD)
+    db.execute(models.OrderArchive.__table__.insert().values(
+        order_id=clash_id, user_id=user.user_id, product_id=product.product_id, quantity=1, total_price=1.0,
+        delivery_address="elsewhere", payment_method="Card", order_status="Delivered", order_date=OLD
+    ))
+    db.commit()
+
+    assert order_archive.archive_orders(db, datetime.now() - timedelta(days=180), 100) == 1
+    db.commit()
+    assert db.query(models.Order.order_id).filter(models.Order.order_id == clash_id).scalar() == clash_id
+    assert db.query(models.OrderArchive).filter(models.OrderArchive.order_id == other_id).count() == 1
+
+
+def test_init_db_rebuilds_orders_created_without_autoincrement(db, make_user, make_product):
+    user = make_user()
+    product = make_product()
+    ids = [_add_order(db, user, product) for _ in range(3)]
+    db.execute(models.OrderArchive.__table__.insert().values(
+        order_id=7, user_id=user.user_id, product_id=product.product_id, quantity=1, total_price=1.0,
+        delivery_address="old", payment_method="Card", order_status="Delivered", order_date=OLD
+    ))
+    db.commit()
+
+    # Recreate orders the way databases created before AUTOINCREMENT have it
+    table = models.Order.__table__
+    with database.engine.begin() as connection:
+        rows = connection.execute(table.select()).mappings().all()
+        connection.execute(text("DROP TABLE orders"))
+        connection.execute(text(str(CreateTable(table).compile(dialect=database.engine.dialect))
+                                .replace(" AUTOINCREMENT", "")))
+        connection.execute(table.insert(), [dict(row) for row in rows])
+
+    database.init_db()
+
+    with database.engine.connect() as connection:
+        sql = connection.execute(text("SELECT sql FROM sqlite_master WHERE name = 'orders'")).scalar()
+        assert "AUTOINCREMENT" in sql
+        assert [row.order_id for row in connection.execute(table.select().order_by(table.c.order_id))] == ids
+    built = {index["name"] for index in inspect(database.engine).get_indexes("orders")}
+    assert {index.name for index in table.indexes} <= built
+
+    # The sequence continues after the archive's highest ID
+    assert _add_order(db, user, product) == 8
@@ -0,0 +1,102 @@
+from datetime import datetime
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import event
+from tele import database, models, schemas
+from repository import analytics, order
+
+ORDERS = 60
+
+
+# desc: Place orders for one product directly, with their lines and rollup rows
+def _place_orders(db, user, product, count: int) -> list:
+    orders = [
+        models.Order(user_id=user.user_id, product_id=product.product_id, quantity=1, total_price=product.price,
+                     delivery_address=user.address, payment_method="Card", order_date=datetime.now(),
+                     order_status="Pending", payment_status="Unpaid",
+                     items=[models.OrderItem(product_id=product.product_id, quantity=1, unit_price=product.price,
+                                             total_price=product.price)])
+        for _ in range(count)
+    ]
+    db.add_all(orders)
+    db.flush()
+    analytics.record_orders(db, orders, {product.product_id: product.seller_id})
+    db.commit()
+    return [placed.order_id for placed in orders]
+
+
+def test_bulk_update_with_distinct_values_uses_one_transaction_per_chunk(db, make_user, make_product, monkeypatch):
+    monkeypatch.setattr(order, "ORDER_BULK_CHUNK_SIZE", 25)
+    user = make_user()
+    seller = make_user("seller")
+    product = make_product(seller_id=seller.user_id)
+    order_ids = _place_orders(db, user, product, ORDERS)
+
+    statements, commits = [], []
+
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    def record_commit(conn):
+        commits.append(conn)
+
+    event.listen(database.engine, "before_cursor_execute", record_statement)
+    event.listen(database.engine, "commit", record_commit)
+    try:
+        result = order.bulk_update_orders(schemas.OrderBulkUpdate(updates=[
+            schemas.OrderBulkItem(order_id=order_id, order_status="Shipped", payment_status="paid",
+                                  tracking_number=f"WAVE{order_id}")
+            for order_id in order_ids
+        ] + [schemas.OrderBulkItem(order_id=999999, order_status="Shipped")]), db)
+    finally:
+        event.remove(database.engine, "before_cursor_execute", record_statement)
+        event.remove(database.engine, "commit", record_commit)
+
+    assert (result["updated"], result["not_found"], result["failed"]) == (ORDERS, 1, 0)
+    # Three chunks (60 orders and one unknown ID, 25 per chunk), one commit each, however many values differ
+    assert len(commits) == 3
+    assert len(statements) < 3 * 6
+
+    db.expire_all()
+    rows = db.query(models.Order.order_id, models.Order.order_status, models.Order.tracking_number) \
+             .filter(models.Order.order_id.in_(order_ids)).all()
+    assert all(row.order_status == "Shipped" and row.tracking_number == f"WAVE{row.order_id}" for row in rows)
+    # The rollup moved with the orders: all still count, and all are now paid
+    totals = analytics.get_seller_sales(db, seller.user_id)["totals"]
+    assert totals["order_count"] == ORDERS
+    assert totals["paid_revenue"] == totals["revenue"] == ORDERS * product.price
+
+
+def test_only_the_offending_orders_of_a_chunk_fail(db, make_user, make_product):
+    user = make_user()
+    product = make_product(seller_id=make_user("seller").user_id)
+    order_ids = _place_orders(db, user, product, 6)
+    db.query(models.Order).filter(models.Order.order_id == order_ids[0]).update({models.Order.tracking_number: "TAKEN"})
+    db.commit()
+
+    # One number already belongs to another order, one is given to two orders of the same chunk
+    numbers = {order_ids[1]: "TAKEN", order_ids[2]: "TWICE", order_ids[3]: "TWICE"}
+    result = order.bulk_update_orders(schemas.OrderBulkUpdate(updates=[
+        schemas.OrderBulkItem(order_id=order_id, order_status="Shipped",
+                              tracking_number=numbers.get(order_id, f"OWN{order_id}"))
+        for order_id in order_ids[1:]
+    ]), db)
+
+    assert (result["updated"], result["failed"]) == (3, 2)
+    failed = {outcome["order_id"]: outcome["detail"] for outcome in result["outcomes"] if outcome["status"] == "failed"}
+    assert failed == {order_ids[1]: order.TRACKING_NUMBER_IN_USE, order_ids[3]: order.TRACKING_NUMBER_IN_USE}
+
+
+def test_filter_matching_more_than_the_cap_is_rejected(db, make_user, make_product, monkeypatch):
+    monkeypatch.setattr(order, "ORDER_BULK_MAX_ORDERS", 10)
+    user = make_user()
+    product = make_product(seller_id=make_user("seller").user_id)
+    _place_orders(db, user, product, 11)
+
+    request = schemas.OrderBulkUpdate(filter=schemas.OrderBulkFilter(order_status="Pending"),
+                                      patch=schemas.OrderUpdate(order_status="Shipped"))
+    with pytest.raises(HTTPException) as rejected:
+        order.bulk_update_orders(request, db)
+    assert rejected.value.status_code == 400
+    db.expire_all()
+    assert db.query(models.Order).filter(models.Order.order_status == "Shipped").count() == 0
@@ -0,0 +1,30 @@
+from sqlalchemy import event
+from tele import database, models
+from repository import order_items
+
+
+def test_backfill_writes_missing_lines_once(db, make_user, make_product):
+    user = make_user()
+    product = make_product(price=4.0)
+    # An order from before order_items existed: the line is only on the header
+    db.add(models.Order(user_id=user.user_id, product_id=product.product_id, quantity=3, total_price=12.0,
+                        delivery_address="here", payment_method="Card"))
+    db.commit()
+
+    assert order_items.backfill_order_items() == 1
+    line = db.query(models.OrderItem).one()
+    assert (line.product_id, line.quantity, line.unit_price, line.total_price) == (product.product_id, 3, 4.0, 12.0)
+
+    # Once finished, later startups do not scan the orders again
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(database.engine, "before_cursor_execute", record)
+    try:
+        assert order_items.backfill_order_items() == 0
+    finally:
+        event.remove(database.engine, "before_cursor_execute", record)
+    assert len(statements) == 1
+    assert order_items.backfill_order_items(force=True) == 0
@@ -0,0 +1,19 @@
+from fastapi.testclient import TestClient
+from tele import models, schemas
+from tele.main import app
+from repository import order
+
+
+def test_delete_order_returns_no_content(db, make_user, make_product):
+    user = make_user()
+    product = make_product(stock=5)
+    placed = order.create_order(schemas.OrderCreate(product_id=product.product_id, quantity=2, total_price=0,
+                                                    delivery_address=None, payment_method="Card"),
+                                user.user_id, db)
+
+    response = TestClient(app).delete(f"/orders/delete/{placed.order_id}")
+
+    assert response.status_code == 204
+    db.expire_all()
+    assert db.query(models.Order).filter(models.Order.order_id == placed.order_id).count() == 0
+    assert db.query(models.OrderItem).filter(models.OrderItem.order_id == placed.order_id).count() == 0
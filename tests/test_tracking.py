@@ -0,0 +1,28 @@
+from sqlalchemy import inspect, text
+from tele import database, models
+from tele.tracking import generate_tracking_number, generate_tracking_numbers
+
+
+def test_tracking_numbers_are_unique_and_time_ordered():
+    numbers = generate_tracking_numbers(5000) + [generate_tracking_number() for _ in range(100)]
+    assert len(set(numbers)) == len(numbers)
+    assert numbers == sorted(numbers)
+
+
+def test_init_db_reissues_shared_tracking_numbers_before_indexing(db, make_user, make_product):
+    user = make_user()
+    product = make_product()
+    # Databases from before the unique index could have orders sharing a tracking number
+    db.execute(text("DROP INDEX ix_orders_tracking_number"))
+    for tracking_number in ("SHARED", "SHARED", "SHARED", "OWN", None, None):
+        db.add(models.Order(user_id=user.user_id, product_id=product.product_id, quantity=1, total_price=1.0,
+                            delivery_address="here", payment_method="Card", tracking_number=tracking_number))
+    db.commit()
+
+    database.init_db()
+
+    numbers = [number for (number,) in db.query(models.Order.tracking_number).order_by(models.Order.order_id)]
+    assert numbers[0] == "SHARED" and numbers[3] == "OWN" and numbers[4:] == [None, None]
+    assert len(set(numbers[:4])) == 4
+    indexes = {index["name"]: index for index in inspect(database.engine).get_indexes("orders")}
+    assert indexes["ix_orders_tracking_number"]["unique"]